@@ -0,0 +1,81 @@
+"""
+Compares the reservation history enrichment backends (OpenSearch works index vs.
+Postgres editions) on increasingly large identifier sets.
+
+Uses the backends configured in `.env`. Run with:
+
+    poetry run python -m benchmarks.enrichment --sizes 1000,10000,50000
+"""
+
+import argparse
+import statistics
+import time
+
+from lib.database import Edition, Identifier, SessionLocal, get_edition_data
+from lib.opensearch import get_os_client, get_work_data
+
+
+def sample_identifiers(db, count: int) -> list[str]:
+    """
+    Picks up to `count` identifiers that have an edition in the database.
+    """
+    query = (
+        db.query(Identifier.identifier)
+        .join(Edition, Edition.primary_identifier_id == Identifier.id)
+        .order_by(Identifier.id)
+        .limit(count)
+    )
+    return [identifier for (identifier,) in query.all()]
+
+
+def measure(lookup, identifiers: list[str], repeat: int):
+    """
+    Runs the lookup `repeat` times and returns the timings and the number of
+    identifiers that were resolved.
+    """
+    timings = []
+    resolved = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        resolved = len(lookup(identifiers))
+        timings.append(time.perf_counter() - start)
+    return timings, resolved
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        default="1000,10000,50000",
+        help="Comma separated identifier set sizes",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    db = SessionLocal()
+    os_client_dependency = get_os_client()
+    os_client = next(os_client_dependency)
+
+    backends = {
+        "opensearch": lambda identifiers: get_work_data(os_client, identifiers),
+        "postgres": lambda identifiers: get_edition_data(db, identifiers),
+    }
+
+    print(f"{'backend':<12}{'size':>10}{'resolved':>10}{'median s':>12}{'min s':>10}")
+    try:
+        for size in sizes:
+            identifiers = sample_identifiers(db, size)
+            for name, lookup in backends.items():
+                timings, resolved = measure(lookup, identifiers, args.repeat)
+                print(
+                    f"{name:<12}{len(identifiers):>10}{resolved:>10}"
+                    f"{statistics.median(timings):>12.3f}{min(timings):>10.3f}"
+                )
+    finally:
+        db.close()
+        os_client_dependency.close()
+
+
+if __name__ == "__main__":
+    main()
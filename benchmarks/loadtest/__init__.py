@@ -0,0 +1,10 @@
+"""
+End-to-end load test harness: runs the app under uvicorn with several workers
+against a stub OpenSearch server and a synthetic SQLite database.
+"""
+
+import os
+
+# lib.database creates its engine on import, the harness itself only needs the
+# models so any valid URL will do when no .env is present
+os.environ.setdefault("POSTGRES_URL", "sqlite://")
@@ -0,0 +1,273 @@
+"""
+Runs the app under uvicorn with several workers against local backend stand-ins
+and drives concurrent mixed traffic through it, then reports throughput and
+latency percentiles per endpoint.
+
+    poetry run python -m benchmarks.loadtest --workers 4 --concurrency 32 --duration 30
+
+By default the synthetic database is a temporary SQLite file. Pass
+--database-url to fill and target a local (throwaway) Postgres instead, to
+include its query plans and connection pool behavior.
+"""
+
+import argparse
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import httpx
+
+from benchmarks.loadtest import synthetic_db
+from benchmarks.loadtest.stub_opensearch import StubOpenSearchServer
+
+ROOT = Path(__file__).resolve().parents[2]
+EVENT_INDEX = "loadtest-events"
+WORK_INDEX = "loadtest-works"
+
+
+def held_identifier(collection: int, args) -> str:
+    """
+    A random identifier of the collection with active holds, as the others 404.
+    """
+    while True:
+        number = random.randrange(args.identifiers)
+        if synthetic_db.hold_count(collection, number):
+            return synthetic_db.identifier(collection, number)
+
+
+# Endpoint name -> function building a request path for a collection
+ENDPOINTS = {
+    "active-reservations": lambda collection, args: "/active-reservations",
+    "active-reservations-item": lambda collection, args: (
+        "/active-reservations/" + held_identifier(collection, args)
+    ),
+    "reservation-history": lambda collection, args: "/reservation-history",
+    "reservation-history-top": lambda collection, args: (
+        "/reservation-history?sort=count_desc&limit=100"
+    ),
+    "reservation-history-counts": lambda collection, args: (
+        "/reservation-history?fields=identifier,count"
+    ),
+    "reservation-history-item": lambda collection, args: (
+        "/reservation-history/"
+        + synthetic_db.identifier(collection, random.randrange(args.identifiers))
+        + "?interval=month"
+    ),
+    "reservation-history-windows": lambda collection, args: (
+        "/reservation-history/windows"
+        "?window=2024-01-01/2024-01-31&window=2023-01-01/2023-01-31"
+    ),
+}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def parse_mix(mix: str) -> dict[str, int]:
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        if name not in ENDPOINTS:
+            raise SystemExit(f"Unknown endpoint in mix: {name}")
+        weights[name] = int(weight or 1)
+    return weights
+
+
+def start_app(args, database_url: str, opensearch_url: str, cache_path: str):
+    port = free_port()
+    env = {
+        **os.environ,
+        "POSTGRES_URL": database_url,
+        "OPENSEARCH_URL": opensearch_url,
+        "OPENSEARCH_EVENT_INDEX": EVENT_INDEX,
+        "OPENSEARCH_WORK_INDEX": WORK_INDEX,
+        "ENRICHMENT_BACKEND": args.enrichment_backend,
+        "CACHE_PATH": cache_path,
+    }
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "main:app",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(port),
+            "--workers",
+            str(args.workers),
+            "--log-level",
+            "warning",
+        ],
+        cwd=ROOT,
+        env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit("uvicorn exited during startup")
+        try:
+            httpx.get(base_url + "/", timeout=1)
+            return process, base_url
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.terminate()
+    raise SystemExit("uvicorn did not start in 30 seconds")
+
+
+def run_traffic(args, base_url: str, weights: dict[str, int]):
+    """
+    Sends requests from `concurrency` threads until the duration has passed.
+    Each request uses the token of a randomly picked collection. Server errors
+    (and failed connections) and other non-2xx responses are counted apart.
+    """
+    samples: dict[str, list[float]] = defaultdict(list)
+    errors: dict[str, int] = defaultdict(int)
+    rejected: dict[str, int] = defaultdict(int)
+    lock = threading.Lock()
+    stop_at = time.monotonic() + args.duration
+    names, endpoint_weights = list(weights), list(weights.values())
+
+    def worker():
+        with httpx.Client(base_url=base_url, timeout=args.timeout) as client:
+            while time.monotonic() < stop_at:
+                name = random.choices(names, endpoint_weights)[0]
+                collection = random.randint(1, args.collections)
+                path = ENDPOINTS[name](collection, args)
+                headers = {"Token": synthetic_db.api_token(collection)}
+                start = time.perf_counter()
+                status_code = None
+                try:
+                    status_code = client.get(path, headers=headers).status_code
+                except httpx.HTTPError:
+                    pass
+                elapsed = time.perf_counter() - start
+                with lock:
+                    samples[name].append(elapsed)
+                    if status_code is None or status_code >= 500:
+                        errors[name] += 1
+                    elif not 200 <= status_code < 300:
+                        rejected[name] += 1
+
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, errors, rejected, time.monotonic() - started
+
+
+def percentile(values: list[float], percent: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method="inclusive")[percent - 1]
+
+
+def report(samples, errors, rejected, elapsed: float):
+    print(
+        f"{'endpoint':<28}{'requests':>10}{'errors':>8}{'non-2xx':>9}{'req/s':>10}"
+        f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    )
+    rows = sorted(samples.items()) + [
+        ("TOTAL", [value for values in samples.values() for value in values])
+    ]
+    for name, values in rows:
+        error_count = sum(errors.values()) if name == "TOTAL" else errors[name]
+        rejected_count = sum(rejected.values()) if name == "TOTAL" else rejected[name]
+        print(
+            f"{name:<28}{len(values):>10}{error_count:>8}{rejected_count:>9}"
+            f"{len(values) / elapsed:>10.1f}"
+            + "".join(
+                f"{percentile(values, percent) * 1000:>10.1f}"
+                for percent in (50, 95, 99)
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4, help="uvicorn workers")
+    parser.add_argument("--concurrency", type=int, default=32, help="client threads")
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--timeout", type=float, default=60, help="request timeout")
+    parser.add_argument("--collections", type=int, default=5)
+    parser.add_argument(
+        "--identifiers", type=int, default=2000, help="works per collection"
+    )
+    parser.add_argument(
+        "--latency-ms", type=float, default=20, help="stub OpenSearch latency"
+    )
+    parser.add_argument(
+        "--jitter-ms", type=float, default=10, help="extra random stub latency"
+    )
+    parser.add_argument(
+        "--enrichment-backend", choices=("opensearch", "postgres"), default="opensearch"
+    )
+    parser.add_argument("--cache", action="store_true", help="enable the shared cache")
+    parser.add_argument(
+        "--database-url",
+        help="fill and target this database (e.g. a local Postgres) instead of a "
+        "temporary SQLite file. Its Circulation tables are dropped and recreated!",
+    )
+    parser.add_argument(
+        "--mix",
+        default=(
+            "active-reservations=3,active-reservations-item=3,reservation-history=2,"
+            "reservation-history-top=1,reservation-history-counts=1"
+        ),
+        help="comma separated endpoint=weight pairs, endpoints: "
+        + ", ".join(ENDPOINTS),
+    )
+    args = parser.parse_args()
+    weights = parse_mix(args.mix)
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_url = args.database_url or f"sqlite:///{directory}/circulation.sqlite"
+        print(
+            f"Creating database with {args.collections} collections of "
+            f"{args.identifiers} works..."
+        )
+        synthetic_db.create_database(database_url, args.collections, args.identifiers)
+
+        opensearch = StubOpenSearchServer(
+            ("127.0.0.1", 0),
+            event_index=EVENT_INDEX,
+            work_index=WORK_INDEX,
+            identifiers=args.identifiers,
+            latency=args.latency_ms / 1000,
+            jitter=args.jitter_ms / 1000,
+        )
+        opensearch.start()
+
+        cache_path = f"{directory}/cache.sqlite" if args.cache else ""
+        process, base_url = start_app(args, database_url, opensearch.url, cache_path)
+        try:
+            print(
+                f"Running {args.concurrency} clients against {args.workers} workers "
+                f"for {args.duration:g}s..."
+            )
+            samples, errors, rejected, elapsed = run_traffic(args, base_url, weights)
+        finally:
+            process.terminate()
+            process.wait()
+            opensearch.shutdown()
+
+    report(samples, errors, rejected, elapsed)
+
+
+if __name__ == "__main__":
+    main()
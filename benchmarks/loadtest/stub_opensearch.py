@@ -0,0 +1,239 @@
+"""
+A stand-in for OpenSearch that answers the event aggregation and works queries
+made by `lib/opensearch.py` with synthetic data after a configurable delay.
+"""
+
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.loadtest import synthetic_db
+
+
+class StubData:
+    """
+    Synthetic hold events: every collection has `identifiers` works, each with
+    a deterministic number of hold events.
+    """
+
+    def __init__(self, identifiers: int):
+        self.identifiers = identifiers
+
+    def event_counts(self, collection_name: str) -> dict[str, int]:
+        collection = synthetic_db.collection_index(collection_name)
+        if collection is None:
+            return {}
+        return {
+            synthetic_db.identifier(collection, number): self.count(collection, number)
+            for number in range(self.identifiers)
+        }
+
+    @staticmethod
+    def count(collection: int, number: int) -> int:
+        return zlib.crc32(f"{collection}:{number}".encode()) % 50 + 1
+
+
+def find_clauses(query, name: str) -> list[dict]:
+    """
+    Collects all clauses of the given type (e.g. "term") from a query body.
+    """
+    found = []
+    if isinstance(query, dict):
+        for key, value in query.items():
+            if key == name:
+                found.append(value)
+            else:
+                found.extend(find_clauses(value, name))
+    elif isinstance(query, list):
+        for item in query:
+            found.extend(find_clauses(item, name))
+    return found
+
+
+def add_window_counts(buckets: list[dict], aggregation: dict) -> list[dict]:
+    """
+    Adds the counts of the multi-window query's windows to identifier buckets:
+    the n:th window has n events less. Also used by the tests' OpenSearch mock.
+    """
+    window_filters = (
+        aggregation.get("aggs", {}).get("windows", {}).get("filters", {})
+    ).get("filters", {})
+    for bucket in buckets:
+        if window_filters:
+            bucket["windows"] = {
+                "buckets": {
+                    key: {"doc_count": max(bucket["doc_count"] - index, 0)}
+                    for index, key in enumerate(window_filters)
+                }
+            }
+    return buckets
+
+
+def event_search(data: StubData, body: dict) -> dict:
+    query = body.get("query", {})
+    term_filters = {
+        key: value
+        for clause in find_clauses(query, "term")
+        for key, value in clause.items()
+    }
+    counts = data.event_counts(term_filters.get("collection", ""))
+
+    for prefix in find_clauses(query, "prefix"):
+        counts = {
+            key: value
+            for key, value in counts.items()
+            if key.startswith(prefix["identifier"])
+        }
+    if "identifier" in term_filters:
+        counts = {
+            key: value
+            for key, value in counts.items()
+            if key == term_filters["identifier"]
+        }
+
+    hits = {"total": {"value": sum(counts.values()), "relation": "eq"}, "hits": []}
+    if "identifier" not in body.get("aggs", {}):
+        # Single identifier query, with all of its events on one day
+        result: dict = {"hits": hits}
+        if "histogram" in body.get("aggs", {}):
+            buckets = [
+                {"key_as_string": "2024-01-01", "doc_count": hits["total"]["value"]}
+            ]
+            result["aggregations"] = {"histogram": {"buckets": buckets}}
+        return result
+
+    aggregation = body["aggs"]["identifier"]
+
+    if "composite" in aggregation:
+        composite = aggregation["composite"]
+        after = composite.get("after", {}).get("identifier")
+        keys = sorted(key for key in counts if after is None or key > after)
+        keys = keys[: composite.get("size", 10)]
+        result = {
+            "buckets": [
+                {"key": {"identifier": key}, "doc_count": counts[key]} for key in keys
+            ]
+        }
+        add_window_counts(result["buckets"], aggregation)
+        if keys:
+            result["after_key"] = {"identifier": keys[-1]}
+        return {"hits": hits, "aggregations": {"identifier": result}}
+
+    terms = aggregation["terms"]
+    buckets = [
+        {"key": key, "doc_count": value}
+        for key, value in counts.items()
+        if value >= terms.get("min_doc_count", 1)
+    ]
+    if terms.get("order") == {"_key": "asc"}:
+        buckets.sort(key=lambda bucket: bucket["key"])
+    else:
+        buckets.sort(key=lambda bucket: (-bucket["doc_count"], bucket["key"]))
+    buckets = add_window_counts(buckets[: terms.get("size", 10)], aggregation)
+
+    return {
+        "hits": hits,
+        "aggregations": {
+            "identifier": {
+                "doc_count_error_upper_bound": 0,
+                "sum_other_doc_count": 0,
+                "buckets": buckets,
+            }
+        },
+    }
+
+
+def work_search(body: dict) -> dict:
+    identifiers = [
+        identifier
+        for clause in find_clauses(body.get("query", {}), "terms")
+        for identifier in clause.get("identifiers.identifier", [])
+    ]
+    identifiers += [
+        clause["identifiers.identifier"]
+        for clause in find_clauses(body.get("query", {}), "term")
+        if "identifiers.identifier" in clause
+    ]
+    hits = [
+        {
+            "_source": {
+                "identifiers": [{"type": "ISBN", "identifier": identifier}],
+                "title": synthetic_db.title(identifier),
+                "author": synthetic_db.author(identifier),
+            }
+        }
+        for identifier in identifiers[: body.get("size", 10)]
+    ]
+    return {"hits": {"total": {"value": len(hits), "relation": "eq"}, "hits": hits}}
+
+
+class StubOpenSearchServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        event_index: str,
+        work_index: str,
+        identifiers: int,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+    ):
+        super().__init__(address, StubOpenSearchHandler)
+        self.event_index = event_index
+        self.work_index = work_index
+        self.data = StubData(identifiers)
+        self.latency = latency
+        self.jitter = jitter
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+class StubOpenSearchHandler(BaseHTTPRequestHandler):
+    server: StubOpenSearchServer
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def respond(self, status: int, payload: dict):
+        encoded = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def do_GET(self):
+        self.do_POST()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        index, _, endpoint = self.path.split("?")[0].strip("/").partition("/")
+
+        delay = self.server.latency + random.uniform(0, self.server.jitter)
+        if delay:
+            time.sleep(delay)
+
+        if endpoint != "_search":
+            self.respond(
+                200, {"name": "stub-opensearch", "version": {"number": "2.11.0"}}
+            )
+        elif index == self.server.event_index:
+            self.respond(200, event_search(self.server.data, body))
+        elif index == self.server.work_index:
+            self.respond(200, work_search(body))
+        else:
+            self.respond(404, {"error": f"no such index [{index}]", "status": 404})
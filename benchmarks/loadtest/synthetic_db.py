@@ -0,0 +1,134 @@
+"""
+Synthetic Circulation database for load testing. The same naming scheme is used
+by the stub OpenSearch server so that both backends describe the same works.
+"""
+
+import zlib
+
+from sqlalchemy import create_engine, insert
+
+from lib.database import (
+    ApiToken,
+    Base,
+    Collection,
+    Edition,
+    Hold,
+    Identifier,
+    IntegrationConfiguration,
+    LicensePool,
+)
+
+
+def collection_name(collection: int) -> str:
+    return f"Load Test Collection {collection}"
+
+
+def collection_index(name: str) -> int | None:
+    prefix = collection_name(0)[:-1]
+    if name.startswith(prefix) and name[len(prefix) :].isdigit():
+        return int(name[len(prefix) :])
+    return None
+
+
+def api_token(collection: int) -> str:
+    return f"loadtest-token-{collection}"
+
+
+def identifier(collection: int, number: int) -> str:
+    return f"978{collection:03d}{number:07d}"
+
+
+def title(identifier: str) -> str:
+    return f"Synthetic book {identifier}"
+
+
+def author(identifier: str) -> str:
+    return f"Synthetic author {int(identifier[-3:]) % 100}"
+
+
+HOLD_COUNTS = (0, 0, 1, 2, 5, 20)
+
+
+def hold_count(collection: int, number: int) -> int:
+    """
+    The deterministic number of holds a work has, so that traffic can pick
+    works with holds without querying the database.
+    """
+    return HOLD_COUNTS[
+        zlib.crc32(f"holds:{collection}:{number}".encode()) % len(HOLD_COUNTS)
+    ]
+
+
+TABLES = [
+    ApiToken.__table__,
+    Identifier.__table__,
+    Edition.__table__,
+    IntegrationConfiguration.__table__,
+    Collection.__table__,
+    LicensePool.__table__,
+    Hold.__table__,
+]
+
+
+def create_database(url: str, collections: int, identifiers: int):
+    """
+    Creates the tables the app reads and fills them with `identifiers` works
+    per collection, each with a number of holds given by `hold_count`.
+
+    NOTE: existing tables are dropped first, only point this at a throwaway database.
+    """
+    engine = create_engine(url)
+    Base.metadata.drop_all(bind=engine, tables=TABLES)
+    Base.metadata.create_all(bind=engine, tables=TABLES)
+
+    rows: dict = {table: [] for table in Base.metadata.sorted_tables}
+    row_id = 0
+    hold_id = 0
+
+    for collection in range(1, collections + 1):
+        rows[IntegrationConfiguration.__table__].append(
+            {"id": collection, "name": collection_name(collection)}
+        )
+        rows[Collection.__table__].append(
+            {"id": collection, "integration_configuration_id": collection}
+        )
+        rows[ApiToken.__table__].append(
+            {
+                "id": collection,
+                "token": api_token(collection),
+                "label": f"load test {collection}",
+                "collection_id": collection,
+            }
+        )
+        for number in range(identifiers):
+            row_id += 1
+            work_identifier = identifier(collection, number)
+            rows[Identifier.__table__].append(
+                {"id": row_id, "identifier": work_identifier}
+            )
+            rows[Edition.__table__].append(
+                {
+                    "id": row_id,
+                    "permanent_work_id": str(row_id),
+                    "title": title(work_identifier),
+                    "author": author(work_identifier),
+                    "primary_identifier_id": row_id,
+                }
+            )
+            rows[LicensePool.__table__].append(
+                {
+                    "id": row_id,
+                    "presentation_edition_id": row_id,
+                    "collection_id": collection,
+                }
+            )
+            for _ in range(hold_count(collection, number)):
+                hold_id += 1
+                rows[Hold.__table__].append({"id": hold_id, "license_pool_id": row_id})
+
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if rows.get(table):
+                connection.execute(insert(table), rows[table])
+
+    engine.dispose()
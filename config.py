@@ -1,3 +1,5 @@
+from typing import Literal
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -7,6 +9,36 @@ class Settings(BaseSettings):
     OPENSEARCH_EVENT_INDEX: str = ""
     OPENSEARCH_WORK_INDEX: str = ""
     ROOT_PATH: str = ""
+    # Where reservation history gets titles and authors from
+    ENRICHMENT_BACKEND: Literal["opensearch", "postgres"] = "opensearch"
+    # Local file for the cache shared by all workers on a host, empty disables caching
+    CACHE_PATH: str = ""
+    # Time budget of a request in seconds, 0 disables
+    REQUEST_DEADLINE: float = 15
+    # Local directory for daily active hold count snapshots, empty disables them
+    HOLDS_HISTORY_PATH: str = ""
+    # How often (in seconds) to check whether today's snapshot has been recorded
+    HOLDS_SNAPSHOT_CHECK_INTERVAL: int = 3600
+    # Local file for collection-wide rollups served when they cover a request,
+    # empty disables them
+    ROLLUP_PATH: str = ""
+    # How often (in seconds) to refresh the rollups
+    ROLLUP_REFRESH_INTERVAL: int = 3600
+    # Serve active reservations from hold count rollups younger than this (in
+    # seconds), marked with the X-Data-As-Of header. 0 always queries Postgres
+    ROLLUP_HOLDS_MAX_AGE: int = 0
+    # Requests slower than this (in seconds) are captured with their queries, 0 disables
+    SLOW_REQUEST_THRESHOLD: float = 0
+    SLOW_REQUEST_BUFFER_SIZE: int = 100
+    # Add EXPLAIN (ANALYZE, BUFFERS) plans / OpenSearch profiles to captured requests
+    SLOW_REQUEST_EXPLAIN: bool = False
+    SLOW_REQUEST_PROFILE: bool = False
+    # Token for the admin endpoints, empty disables them
+    ADMIN_TOKEN: str = ""
+    # Cache lifetimes in seconds
+    TOKEN_CACHE_TTL: int = 300
+    WORK_CACHE_TTL: int = 86400
+    RESPONSE_CACHE_TTL: int = 60
 
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8")
 
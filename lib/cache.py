@@ -0,0 +1,255 @@
+import hashlib
+import logging
+import sqlite3
+import struct
+import threading
+import time
+from typing import Callable
+
+from config import settings
+from lib.deadline import Deadline
+from lib.local_store import SQLiteConnections
+from lib.models import Reservation
+
+logger = logging.getLogger(__name__)
+
+
+class SharedCache:
+    """
+    A key-value cache stored in a local SQLite file.
+
+    Every uvicorn worker on the host opens the same file, so they all share one
+    warm copy instead of each keeping (and warming) its own in-process cache.
+    The cache is best effort: an empty path disables it and storage errors are
+    logged and treated as cache misses.
+    """
+
+    PURGE_INTERVAL = 1000
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connections = SQLiteConnections(
+            path,
+            "PRAGMA synchronous=NORMAL;"
+            "CREATE TABLE IF NOT EXISTS cache "
+            "(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL);",
+            timeout=5,
+        )
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def _connection(self) -> sqlite3.Connection:
+        return self._connections.get()
+
+    def get_many(self, keys: list[str]) -> dict[str, bytes]:
+        """
+        Returns the unexpired values found for the given keys.
+        """
+        if not self.enabled or not keys:
+            return {}
+
+        found = {}
+        BATCH_SIZE = 500
+        try:
+            connection = self._connection()
+            for start in range(0, len(keys), BATCH_SIZE):
+                batch = keys[start : start + BATCH_SIZE]
+                rows = connection.execute(
+                    "SELECT key, value FROM cache WHERE expires_at > ? AND key IN "
+                    f"({', '.join('?' * len(batch))})",
+                    [time.time(), *batch],
+                )
+                found.update(rows)
+        except sqlite3.Error:
+            logger.warning("Reading from cache %s failed", self.path, exc_info=True)
+        return found
+
+    def get(self, key: str) -> bytes | None:
+        return self.get_many([key]).get(key)
+
+    def set_many(self, items: dict[str, bytes], ttl: int):
+        """
+        Stores the given values for `ttl` seconds.
+        """
+        if not self.enabled or not items or ttl <= 0:
+            return
+
+        now = time.time()
+        try:
+            connection = self._connection()
+            with connection:
+                connection.execute("BEGIN")
+                connection.executemany(
+                    "INSERT OR REPLACE INTO cache (key, value, expires_at) "
+                    "VALUES (?, ?, ?)",
+                    [(key, value, now + ttl) for key, value in items.items()],
+                )
+                # The worker's threadpool threads share the write count
+                with self._writes_lock:
+                    self._writes += 1
+                    purge = self._writes % self.PURGE_INTERVAL == 0
+                if purge:
+                    connection.execute("DELETE FROM cache WHERE expires_at <= ?", [now])
+        except sqlite3.Error:
+            logger.warning("Writing to cache %s failed", self.path, exc_info=True)
+
+    def set(self, key: str, value: bytes, ttl: int):
+        self.set_many({key: value}, ttl)
+
+
+cache = SharedCache(settings.CACHE_PATH)
+
+
+# ENCODING
+#
+# Values are packed with struct instead of JSON to keep the cache compact:
+# strings are length prefixed UTF-8 and counts are unsigned 32 bit integers.
+
+_UINT = struct.Struct("<I")
+_ROW = struct.Struct("<IB")
+_HAS_TITLE = 1
+_HAS_AUTHOR = 2
+
+
+def _pack_str(value: str) -> bytes:
+    encoded = value.encode("utf-8")
+    return _UINT.pack(len(encoded)) + encoded
+
+
+def _unpack_str(data: bytes, offset: int) -> tuple[str, int]:
+    (length,) = _UINT.unpack_from(data, offset)
+    offset += _UINT.size
+    return data[offset : offset + length].decode("utf-8"), offset + length
+
+
+def encode_reservations(reservations: list[Reservation]) -> bytes:
+    """
+    Packs reservation rows into bytes. Whether title and author were set is
+    kept, so decoded rows serialize the same way with sparse fieldsets.
+    """
+    parts = [_UINT.pack(len(reservations))]
+    for reservation in reservations:
+        fields_set = reservation.model_fields_set
+        flags = (_HAS_TITLE if "title" in fields_set else 0) | (
+            _HAS_AUTHOR if "author" in fields_set else 0
+        )
+        parts.append(_ROW.pack(reservation.count, flags))
+        parts.append(_pack_str(reservation.identifier))
+        if flags & _HAS_TITLE:
+            parts.append(_pack_str(reservation.title))
+        if flags & _HAS_AUTHOR:
+            parts.append(_pack_str(reservation.author))
+    return b"".join(parts)
+
+
+def decode_reservations(data: bytes) -> list[Reservation]:
+    """
+    Unpacks reservation rows packed with `encode_reservations`.
+    """
+    (length,) = _UINT.unpack_from(data, 0)
+    offset = _UINT.size
+    reservations = []
+    for _ in range(length):
+        count, flags = _ROW.unpack_from(data, offset)
+        offset += _ROW.size
+        row = {"count": count}
+        row["identifier"], offset = _unpack_str(data, offset)
+        if flags & _HAS_TITLE:
+            row["title"], offset = _unpack_str(data, offset)
+        if flags & _HAS_AUTHOR:
+            row["author"], offset = _unpack_str(data, offset)
+        reservations.append(Reservation(**row))
+    return reservations
+
+
+def encode_work(work: dict) -> bytes:
+    return _pack_str(work.get("title", "")) + _pack_str(work.get("author", ""))
+
+
+def decode_work(data: bytes) -> dict:
+    title, offset = _unpack_str(data, 0)
+    author, _ = _unpack_str(data, offset)
+    return {"title": title, "author": author}
+
+
+# CACHING LAYERS
+
+
+def token_cache_key(api_key: str) -> str:
+    """
+    Tokens are only stored hashed, the cache file must not leak them.
+    """
+    return "token:" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+def response_cache_key(*parts) -> str:
+    return "response:" + hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()
+
+
+def cached_work_data(
+    work_data_source: Callable[[list[str]], dict],
+    identifiers: list[str],
+    deadline: Deadline | None = None,
+):
+    """
+    Resolves identifiers to title and author, using cached work data where
+    available and `work_data_source` for the rest. Identifiers without work
+    data are cached as empty so they are not looked up again on every request.
+
+    Parameters:
+    - work_data_source (callable): the enrichment backend
+    - identifiers (list[str]): the identifiers to look up
+    - deadline (Deadline, optional): the request's time budget. If the lookup
+        was cut short, missing identifiers are not cached as empty.
+
+    Returns:
+    - dict mapping each found identifier to a dict with title and author
+    """
+    if not cache.enabled:
+        return work_data_source(identifiers)
+
+    keys = {f"work:{identifier}": identifier for identifier in identifiers}
+    works_map = {
+        keys[key]: decode_work(value)
+        for key, value in cache.get_many(list(keys)).items()
+    }
+
+    missing = [identifier for identifier in identifiers if identifier not in works_map]
+    if missing:
+        fetched = work_data_source(missing)
+        complete = not (deadline and deadline.partial)
+        cache.set_many(
+            {
+                f"work:{identifier}": encode_work(fetched.get(identifier, {}))
+                for identifier in missing
+                if complete or identifier in fetched
+            },
+            ttl=settings.WORK_CACHE_TTL,
+        )
+        works_map.update(fetched)
+
+    return works_map
+
+
+def cached_reservations(
+    key: str,
+    compute: Callable[[], list[Reservation]],
+    deadline: Deadline | None = None,
+):
+    """
+    Returns the reservation rows cached under `key`, or computes and caches them.
+    Partial results (see Deadline) are not cached.
+    """
+    cached = cache.get(key)
+    if cached is not None:
+        return decode_reservations(cached)
+
+    reservations = compute()
+    if deadline and deadline.partial:
+        return reservations
+    cache.set(key, encode_reservations(reservations), ttl=settings.RESPONSE_CACHE_TTL)
+    return reservations
@@ -10,7 +10,8 @@ from sqlalchemy.orm import (
 )
 
 from config import settings
-from lib.models import Reservation
+from lib.deadline import Deadline
+from lib.models import Reservation, ReservationQuery, ReservationSort
 
 engine = create_engine(
     settings.POSTGRES_URL, execution_options={"postgresql_readonly": True}
@@ -100,6 +101,36 @@ class ApiToken(Base):
 # QUERIES
 
 
+def apply_reservation_query(query, params: ReservationQuery | None, count_column):
+    """
+    Applies sorting, filtering and limiting options to a grouped hold count query.
+
+    Parameters:
+    - query: The grouped SQLAlchemy query to modify.
+    - params (ReservationQuery, optional): The requested options.
+    - count_column: The aggregate column used for count filtering and sorting.
+
+    Returns:
+    - The modified query.
+    """
+    params = params or ReservationQuery()
+
+    if params.identifier_prefix:
+        query = query.filter(
+            Identifier.identifier.startswith(params.identifier_prefix, autoescape=True)
+        )
+    if params.min_count:
+        query = query.having(count_column >= params.min_count)
+    if params.sort == ReservationSort.count_desc:
+        query = query.order_by(count_column.desc(), Identifier.identifier)
+    else:
+        query = query.order_by(Identifier.identifier)
+    if params.limit:
+        query = query.limit(params.limit)
+
+    return query
+
+
 def get_api_token(db: Session, token):
     """
     A function to retrieve an API token data from the database based on the provided token string.
@@ -110,10 +141,11 @@ def get_api_token(db: Session, token):
     - token (str): The token string to search for in the database.
 
     Returns:
-    - tuple containing the ApiToken label, and associated collection_id and collection_name.
+    - tuple containing the ApiToken id and label, and associated collection_id and collection_name.
     """
     query = (
         db.query(
+            ApiToken.id,
             ApiToken.label,
             ApiToken.collection_id,
             IntegrationConfiguration.name.label("collection_name"),
@@ -129,14 +161,16 @@ def get_api_token(db: Session, token):
     return result
 
 
-def get_holds_with_edition_data(db: Session, collection_id: int):
+def get_holds_with_edition_data(
+    db: Session, collection_id: int, params: ReservationQuery | None = None
+):
     """
     Get active reservation counts with edition data for whole collection from the database
 
     Parameters:
     - db (Session): The database session object.
-    - token (str): The token string to search for in the database.
     - collection_id (int): The ID of the collection.
+    - params (ReservationQuery, optional): Sorting, filtering and limiting options.
 
     Returns:
     - list of objects with active hold count and edition data.
@@ -144,31 +178,34 @@ def get_holds_with_edition_data(db: Session, collection_id: int):
     if not collection_id:
         raise HTTPException(status_code=404, detail="Invalid collection configuration")
 
+    params = params or ReservationQuery()
+    # Edition is always joined as it links the license pool to its identifier,
+    # but title and author are only selected and grouped by when requested
+    edition_columns = [Edition.title, Edition.author] if params.needs_work_data else []
+
     query = (
         db.query(
             func.count(Hold.id).label("active_holds"),
             Identifier.identifier,
-            Edition.title,
-            Edition.author,
+            *edition_columns,
         )
         .join(LicensePool, Hold.license_pool_id == LicensePool.id)
         .join(Edition, LicensePool.presentation_edition_id == Edition.id)
         .join(Identifier, Edition.primary_identifier_id == Identifier.id)
         .filter(LicensePool.collection_id == collection_id)
-        .group_by(Identifier.identifier, Edition.title, Edition.author)
-        .order_by(Identifier.identifier)
+        .group_by(Identifier.identifier, *edition_columns)
     )
+    query = apply_reservation_query(query, params, func.count(Hold.id))
 
     results = query.all()
 
     holds_with_edition_data = [
         Reservation(
-            count=active_holds,
-            identifier=identifier,
-            title=title,
-            author=author,
+            count=row.active_holds,
+            identifier=row.identifier,
+            **params.work_fields(row._asdict()),
         )
-        for active_holds, identifier, title, author in results
+        for row in results
     ]
 
     return holds_with_edition_data
@@ -217,3 +254,72 @@ def get_reservations_for_identifier(db: Session, identifier: str, collection_id:
         title=result.title,
         author=result.author,
     )
+
+
+def get_edition_data(
+    db: Session, identifiers: list[str], deadline: Deadline | None = None
+):
+    """
+    Get title and author for the given identifiers from their editions in the database.
+    Used as an alternative to the works index for enriching reservation history.
+
+    Parameters:
+    - db (Session): The database session object.
+    - identifiers (list[str]): The identifiers to look up.
+    - deadline (Deadline, optional): The request's time budget. When it runs out
+        the remaining batches are skipped and the deadline is marked partial.
+
+    Returns:
+    - dict mapping each found identifier to a dict with title and author.
+    """
+    BATCH_SIZE = 10000
+    edition_map = {}
+
+    for start in range(0, len(identifiers), BATCH_SIZE):
+        if deadline and deadline.expired:
+            deadline.partial = True
+            break
+        # An identifier has an edition per data source, only the presentation
+        # edition of its license pools is used (like for active reservations)
+        query = (
+            db.query(Identifier.identifier, Edition.title, Edition.author)
+            .join(Edition, Edition.primary_identifier_id == Identifier.id)
+            .join(LicensePool, LicensePool.presentation_edition_id == Edition.id)
+            .filter(Identifier.identifier.in_(identifiers[start : start + BATCH_SIZE]))
+            .distinct()
+        )
+        for identifier, title, author in query.all():
+            edition_map[identifier] = {"title": title or "", "author": author or ""}
+
+    return edition_map
+
+
+def get_hold_counts_by_collection(db: Session):
+    """
+    Get active reservation counts with edition data for all collections in one grouped query.
+    The same rows feed the hold count rollups and the daily hold count snapshots.
+
+    Parameters:
+    - db (Session): The database session object.
+
+    Returns:
+    - list of (collection_id, identifier, title, author, active_holds) tuples.
+    """
+    # Missing titles and authors are grouped with empty ones, as they are shown the same
+    title = func.coalesce(Edition.title, "")
+    author = func.coalesce(Edition.author, "")
+    query = (
+        db.query(
+            LicensePool.collection_id,
+            Identifier.identifier,
+            title,
+            author,
+            func.count(Hold.id).label("active_holds"),
+        )
+        .join(LicensePool, Hold.license_pool_id == LicensePool.id)
+        .join(Edition, LicensePool.presentation_edition_id == Edition.id)
+        .join(Identifier, Edition.primary_identifier_id == Identifier.id)
+        .group_by(LicensePool.collection_id, Identifier.identifier, title, author)
+    )
+
+    return query.all()
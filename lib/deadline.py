@@ -0,0 +1,28 @@
+import time
+
+
+class Deadline:
+    """
+    Time budget of a single request. Created before authentication and passed on
+    to the backend queries, which use the remaining time as their timeout.
+
+    Steps that can be skipped (like looking up work data) stop when the budget
+    runs out and mark the deadline `partial`, so the response can say its
+    results are incomplete instead of timing out as a whole.
+    """
+
+    def __init__(self, seconds: float | None):
+        self.expires_at = time.monotonic() + seconds if seconds else None
+        self.partial = False
+
+    def remaining(self) -> float | None:
+        """
+        Seconds left in the budget, or None if the request has no deadline.
+        """
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
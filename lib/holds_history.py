@@ -0,0 +1,254 @@
+import datetime
+import json
+import mmap
+import os
+from array import array
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from pathlib import Path
+
+from config import settings
+from lib.database import SessionLocal, get_hold_counts_by_collection
+from lib.local_store import file_lock
+from lib.models import HoldCountSnapshot
+
+COLUMNS = ("day", "identifier", "count")
+
+
+class HoldsHistoryStore:
+    """
+    Append-only columnar store of daily active hold counts on local disk.
+
+    Each collection has its own directory with one file per column (`day`,
+    `identifier`, `count`) of unsigned 32 bit integers, plus an `identifiers`
+    dictionary file the identifier column indexes into. Days are appended in
+    order, so a date range is found by binary search on the day column.
+
+    Column files may have trailing garbage after an interrupted append. Only the
+    row count stored in `meta.json` (replaced atomically after the columns have
+    been written) is trusted, and the next append truncates the columns to it.
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path) if path else None
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    def _read_json(self, path: Path, default: dict) -> dict:
+        try:
+            return json.loads(path.read_text())
+        except FileNotFoundError:
+            return default
+
+    def _write_json(self, path: Path, data: dict):
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(data))
+        os.replace(tmp_path, path)
+
+    def snapshot_days(self) -> list[datetime.date]:
+        """
+        Days for which a snapshot of all collections has been recorded.
+        """
+        days = self._read_json(self.path / "snapshots.json", {"days": []})["days"]
+        return [datetime.date.fromordinal(day) for day in days]
+
+    @contextmanager
+    def lock(self):
+        """
+        Takes the store's write lock without waiting. Yields whether it was taken,
+        so that only one of the workers sharing the store records a snapshot.
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+        with file_lock(self.path / ".lock") as locked:
+            yield locked
+
+    def _append_collection(
+        self, collection_id: int, day: datetime.date, counts: dict[str, int]
+    ):
+        directory = self.path / str(collection_id)
+        directory.mkdir(parents=True, exist_ok=True)
+        meta_path = directory / "meta.json"
+        meta = self._read_json(meta_path, {"rows": 0, "identifiers": 0, "last_day": 0})
+        if meta["last_day"] >= day.toordinal():
+            return
+
+        identifiers = self._read_identifiers(directory, meta["identifiers"])
+        identifier_index = {
+            identifier: index for index, identifier in enumerate(identifiers)
+        }
+        keys = sorted(counts)
+        new_identifiers = [key for key in keys if key not in identifier_index]
+        for identifier in new_identifiers:
+            identifier_index[identifier] = len(identifier_index)
+
+        columns = {
+            "day": array("I", [day.toordinal()] * len(keys)),
+            "identifier": array("I", (identifier_index[key] for key in keys)),
+            "count": array("I", (counts[key] for key in keys)),
+        }
+        for name, values in columns.items():
+            with open(directory / name, "ab") as column:
+                column.truncate(meta["rows"] * values.itemsize)
+                values.tofile(column)
+
+        with open(directory / "identifiers", "ab") as dictionary:
+            dictionary.truncate(
+                sum(len(identifier.encode()) + 1 for identifier in identifiers)
+            )
+            dictionary.write(
+                "".join(f"{identifier}\n" for identifier in new_identifiers).encode()
+            )
+
+        self._write_json(
+            meta_path,
+            {
+                "rows": meta["rows"] + len(keys),
+                "identifiers": len(identifier_index),
+                "last_day": day.toordinal(),
+            },
+        )
+
+    def _read_identifiers(self, directory: Path, length: int) -> list[str]:
+        try:
+            with open(directory / "identifiers", "rb") as dictionary:
+                return [
+                    line.decode()[:-1] for _, line in zip(range(length), dictionary)
+                ]
+        except FileNotFoundError:
+            return []
+
+    def record(self, day: datetime.date, rows):
+        """
+        Appends a snapshot of all collections for the given day. Counts of the
+        same identifier (e.g. split by edition data) are summed.
+
+        Parameters:
+        - day (datetime.date): the day of the snapshot
+        - rows: (collection_id, identifier, count) tuples
+        """
+        by_collection: dict[int, dict[str, int]] = {}
+        for collection_id, identifier, count in rows:
+            counts = by_collection.setdefault(collection_id, {})
+            counts[identifier] = counts.get(identifier, 0) + count
+
+        for collection_id, counts in by_collection.items():
+            self._append_collection(collection_id, day, counts)
+
+        snapshots_path = self.path / "snapshots.json"
+        days = self._read_json(snapshots_path, {"days": []})["days"]
+        if day.toordinal() not in days:
+            self._write_json(snapshots_path, {"days": sorted([*days, day.toordinal()])})
+
+    def read(
+        self,
+        collection_id: int,
+        from_date: datetime.date | None = None,
+        to_date: datetime.date | None = None,
+        identifiers: list[str] | None = None,
+    ) -> list[HoldCountSnapshot]:
+        """
+        Reads the hold counts of a collection on the recorded days within the range.
+        When identifiers are given, days on which they had no holds are included
+        with a count of 0.
+        """
+        first = from_date.toordinal() if from_date else 0
+        last = to_date.toordinal() if to_date else 2**32 - 1
+        directory = self.path / str(collection_id)
+        meta = self._read_json(directory / "meta.json", {"rows": 0, "identifiers": 0})
+        dictionary = self._read_identifiers(directory, meta["identifiers"])
+        wanted = None
+        if identifiers is not None:
+            index = {identifier: number for number, identifier in enumerate(dictionary)}
+            wanted = {
+                index[identifier] for identifier in identifiers if identifier in index
+            }
+
+        found: dict[tuple[int, str], int] = {}
+        if meta["rows"] > 0:
+            with self._columns(directory, meta["rows"]) as (days, keys, counts):
+                start = bisect_left(days, first)
+                end = bisect_right(days, last)
+                for row in range(start, end):
+                    if wanted is None or keys[row] in wanted:
+                        found[(days[row], dictionary[keys[row]])] = counts[row]
+
+        if identifiers is not None:
+            for day in self.snapshot_days():
+                if first <= day.toordinal() <= last:
+                    for identifier in identifiers:
+                        found.setdefault((day.toordinal(), identifier), 0)
+
+        return [
+            HoldCountSnapshot(
+                date=datetime.date.fromordinal(day), identifier=identifier, count=count
+            )
+            for (day, identifier), count in sorted(found.items())
+        ]
+
+    @contextmanager
+    def _columns(self, directory: Path, rows: int):
+        """
+        Maps the column files to memory as sequences of `rows` integers.
+        """
+        files = [open(directory / name, "rb") for name in COLUMNS]
+        maps = []
+        views = []
+        try:
+            for column in files:
+                maps.append(mmap.mmap(column.fileno(), 0, access=mmap.ACCESS_READ))
+                item_size = array("I").itemsize
+                views.append(memoryview(maps[-1])[: rows * item_size].cast("I"))
+            yield views
+        finally:
+            for view in views:
+                view.release()
+            for column_map in maps:
+                column_map.close()
+            for column in files:
+                column.close()
+
+
+holds_history = HoldsHistoryStore(settings.HOLDS_HISTORY_PATH)
+
+
+def record_holds_snapshot(
+    db, store: HoldsHistoryStore, day: datetime.date, hold_counts=None
+) -> bool:
+    """
+    Records the active hold counts of all collections for the given day, unless
+    another worker is already doing it or it has been recorded already.
+
+    Parameters:
+    - hold_counts: rows of `get_hold_counts_by_collection` already queried (e.g.
+      by the rollup refresh), queried from `db` if not given
+
+    Returns:
+    - whether a snapshot was recorded
+    """
+    with store.lock() as locked:
+        if not locked or day in store.snapshot_days():
+            return False
+        if hold_counts is None:
+            hold_counts = get_hold_counts_by_collection(db)
+        store.record(
+            day,
+            (
+                (collection_id, identifier, count)
+                for collection_id, identifier, _, _, count in hold_counts
+            ),
+        )
+        return True
+
+
+def record_todays_holds_snapshot(store: HoldsHistoryStore):
+    """
+    Records today's hold count snapshot if it hasn't been recorded yet. Run
+    periodically when the rollups (which record it on refresh) are disabled.
+    """
+    db = SessionLocal()
+    try:
+        record_holds_snapshot(db, store, datetime.date.today())
+    finally:
+        db.close()
@@ -0,0 +1,86 @@
+"""
+Building blocks of the stores kept in local files and shared by all workers on
+the host: the response cache, the rollups and the hold count history.
+"""
+
+import fcntl
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def file_lock(path: str | os.PathLike):
+    """
+    Takes an exclusive lock on the file without waiting. Yields whether it was
+    taken, so that only one of the workers sharing a store writes to it.
+    """
+    with open(path, "w") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class SQLiteConnections:
+    """
+    Per-thread connections to a SQLite file in WAL mode. sqlite3 connections
+    can't be shared between threads, so each thread of the worker's threadpool
+    gets its own, set up with `script` (pragmas and schema) when opened.
+    """
+
+    def __init__(self, path: str, script: str, timeout: float):
+        self.path = path
+        self.script = script
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def get(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(
+                self.path, timeout=self.timeout, isolation_level=None
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(self.script)
+            self._local.connection = connection
+        return connection
+
+
+class PeriodicTask:
+    """
+    Background thread calling `task` every `interval` seconds. Failures are
+    logged with `description` and retried on the next round.
+    """
+
+    def __init__(self, task: Callable[[], object], interval: float, description: str):
+        self.task = task
+        self.interval = interval
+        self.description = description
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.task()
+            except Exception:
+                logger.exception("%s failed", self.description)
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
@@ -1,11 +1,104 @@
-from pydantic import BaseModel
+import datetime
+from enum import Enum
+
+from pydantic import BaseModel, field_serializer
 
 
 class Reservation(BaseModel):
     count: int
     identifier: str
-    title: str
-    author: str
+    title: str = ""
+    author: str = ""
+
+
+class ReservationSort(str, Enum):
+    identifier = "identifier"
+    count_desc = "count_desc"
+
+
+class ReservationField(str, Enum):
+    identifier = "identifier"
+    count = "count"
+    title = "title"
+    author = "author"
+
+
+class ReservationQuery(BaseModel):
+    """
+    Sorting and filtering options for reservation listings.
+    These are applied by the backend queries, so only the requested rows are fetched.
+    """
+
+    sort: ReservationSort | None = None
+    limit: int | None = None
+    min_count: int | None = None
+    identifier_prefix: str | None = None
+    fields: set[ReservationField] | None = None
+
+    @field_serializer("fields")
+    def serialize_fields(self, fields: set[ReservationField] | None):
+        # Sorted so that equal queries serialize (and cache) the same way
+        return sorted(field.value for field in fields) if fields is not None else None
+
+    def includes(self, field: ReservationField) -> bool:
+        """
+        Whether the given field was requested (all fields are, unless limited with `fields`)
+        """
+        return self.fields is None or field in self.fields
+
+    @property
+    def needs_work_data(self) -> bool:
+        """
+        Whether title or author was requested, i.e. if results need enrichment
+        """
+        return self.includes(ReservationField.title) or self.includes(
+            ReservationField.author
+        )
+
+    def work_fields(self, work: dict) -> dict:
+        """
+        Picks the requested title and author fields from work data
+        """
+        return {
+            field.value: work.get(field.value, "")
+            for field in (ReservationField.title, ReservationField.author)
+            if self.includes(field)
+        }
+
+
+class HistogramInterval(str, Enum):
+    day = "day"
+    week = "week"
+    month = "month"
+    year = "year"
+
+
+class HistogramBucket(BaseModel):
+    date: datetime.date
+    count: int
+
+
+class IdentifierReservationHistory(Reservation):
+    histogram: list[HistogramBucket] | None = None
+
+
+class DateWindow(BaseModel):
+    key: str
+    from_date: datetime.date | None = None
+    to_date: datetime.date | None = None
+
+
+class WindowedReservation(BaseModel):
+    identifier: str
+    title: str = ""
+    author: str = ""
+    counts: dict[str, int]
+
+
+class HoldCountSnapshot(BaseModel):
+    date: datetime.date
+    identifier: str
+    count: int
 
 
 class TokenData(BaseModel):
@@ -1,36 +1,328 @@
 import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from functools import cache, partial
+from typing import Callable, Iterator
+
 from fastapi import HTTPException
-from opensearchpy import OpenSearch
+from opensearchpy import ConnectionTimeout, OpenSearch
 
 from config import settings
-from lib.models import Reservation
-
+from lib.deadline import Deadline
+from lib.models import (
+    DateWindow,
+    HistogramBucket,
+    HistogramInterval,
+    IdentifierReservationHistory,
+    Reservation,
+    ReservationQuery,
+    ReservationSort,
+    WindowedReservation,
+)
+from lib.slow_requests import record_search
 
 use_ssl = settings.OPENSEARCH_URL.startswith("https://")
 
 
+@cache
+def shared_os_client() -> OpenSearch:
+    """
+    The OpenSearch client of the process. It is thread safe and pools its
+    connections, so all requests share it.
+    """
+    return OpenSearch(settings.OPENSEARCH_URL, use_ssl=use_ssl, timeout=20, maxsize=25)
+
+
 def get_os_client():
     """
     A dependency function that yields an OpenSearch client.
+
+    The client is shared and not closed with the request, as streamed responses
+    keep searching after the request's dependencies have been closed.
     """
-    os_client = OpenSearch(
-        settings.OPENSEARCH_URL, use_ssl=use_ssl, timeout=20, maxsize=25
-    )
+    yield shared_os_client()
+
+
+def search(os_client: OpenSearch, index: str, body: dict, **kwargs):
+    """
+    Runs a search, recording its body and duration for slow request capture
+    """
+    start = time.perf_counter()
     try:
-        yield os_client
+        return os_client.search(index=index, body=body, **kwargs)
     finally:
-        os_client.close()
+        record_search(index, body, time.perf_counter() - start)
 
 
 def field(hit, field, default=""):
     return hit.get("_source", {}).get(field, default)
 
 
+def request_timeout(deadline: Deadline | None) -> dict:
+    """
+    Search keyword arguments limiting the request to the time left in the deadline
+    """
+    remaining = deadline.remaining() if deadline else None
+    return {} if remaining is None else {"request_timeout": remaining}
+
+
+def get_work_data(
+    os_client: OpenSearch, identifiers: list[str], deadline: Deadline | None = None
+):
+    """
+    Retrieves title and author for the given identifiers from the works index
+
+    Parameters:
+    - os_client: OpenSearch client
+    - identifiers (list[str]): the identifiers to look up
+    - deadline (Deadline, optional): the request's time budget. When it runs out
+        the remaining batches are skipped and the deadline is marked partial.
+
+    Returns:
+    - dict mapping each found identifier to a dict with title and author
+    """
+    source_fields = [
+        "identifiers",
+        "title",
+        "author",
+    ]
+    BATCH_SIZE = 10000
+    works_map = {}
+
+    while len(identifiers) > 0:
+        if deadline and deadline.expired:
+            deadline.partial = True
+            break
+        identifiers_to_fetch = identifiers[:BATCH_SIZE]
+        identifiers = identifiers[BATCH_SIZE:]
+        work_query = {
+            "size": BATCH_SIZE,
+            "_source": source_fields,
+            "query": {
+                "nested": {
+                    "path": "identifiers",
+                    "query": {
+                        "terms": {"identifiers.identifier": identifiers_to_fetch}
+                    },
+                }
+            },
+        }
+        try:
+            work_result = search(
+                os_client,
+                index=settings.OPENSEARCH_WORK_INDEX,
+                body=work_query,
+                **request_timeout(deadline),
+            )
+        except ConnectionTimeout:
+            if not deadline:
+                raise
+            deadline.partial = True
+            break
+
+        for hit in work_result.get("hits", {}).get("hits", []):
+            work = {"title": field(hit, "title"), "author": field(hit, "author")}
+            for identifier in field(hit, "identifiers", []):
+                works_map[identifier["identifier"]] = work
+
+    return works_map
+
+
+def date_range_filter(
+    from_date: datetime.date | None, to_date: datetime.date | None
+) -> dict:
+    """
+    Builds the query clause matching events that started within a date frame
+    """
+    range = {}
+    if from_date:
+        range["gte"] = from_date
+    if to_date:
+        range["lte"] = to_date
+    return {"range": {"start": range}}
+
+
+def event_filters(
+    collection_name: str,
+    from_date: datetime.date | None = None,
+    to_date: datetime.date | None = None,
+    params: ReservationQuery | None = None,
+) -> list:
+    """
+    Builds the query clauses matching a collection's hold events within a date frame
+    """
+    event_must: list = [
+        {"term": {"type": "circulation_manager_hold_place"}},
+        {"term": {"collection": collection_name}},
+    ]
+
+    if from_date or to_date:
+        event_must.append(date_range_filter(from_date, to_date))
+
+    if params and params.identifier_prefix:
+        event_must.append({"prefix": {"identifier": params.identifier_prefix}})
+
+    return event_must
+
+
+def search_events(os_client: OpenSearch, body: dict, deadline: Deadline | None):
+    """
+    Runs a search on the event index within the deadline, failing with 504 if it can't
+    """
+    if deadline and deadline.expired:
+        raise HTTPException(status_code=504, detail="Request deadline exceeded")
+    try:
+        return search(
+            os_client,
+            index=settings.OPENSEARCH_EVENT_INDEX,
+            body=body,
+            **request_timeout(deadline),
+        )
+    except ConnectionTimeout:
+        raise HTTPException(status_code=504, detail="Request deadline exceeded")
+
+
+def iter_identifier_buckets(
+    os_client: OpenSearch,
+    event_must: list,
+    params: ReservationQuery,
+    deadline: Deadline | None = None,
+    sub_aggs: dict | None = None,
+):
+    """
+    Aggregates events by identifier, yielding pages of buckets with `key` (the
+    identifier), `doc_count` and the results of the optional sub-aggregations.
+
+    Identifier order is paged through with a composite aggregation, one search
+    per page. Count order (the default) and minimum counts need a terms
+    aggregation, which is fetched at once (bounded by the limit) and then split
+    into pages.
+    """
+    PAGE_SIZE = 10000
+    query = {"bool": {"must": event_must}}
+    sub_aggs = {"aggs": sub_aggs} if sub_aggs else {}
+
+    if params.sort != ReservationSort.identifier or params.min_count:
+        identifier_terms: dict = {
+            "field": "identifier",
+            "size": params.limit or 1000000,
+        }
+        if params.sort == ReservationSort.count_desc:
+            identifier_terms["order"] = [{"_count": "desc"}, {"_key": "asc"}]
+        elif params.sort == ReservationSort.identifier:
+            identifier_terms["order"] = {"_key": "asc"}
+        if params.min_count:
+            identifier_terms["min_doc_count"] = params.min_count
+        event_query = {
+            "size": 0,
+            "query": query,
+            "aggs": {"identifier": {"terms": identifier_terms, **sub_aggs}},
+        }
+        event_result = search_events(os_client, event_query, deadline)
+        buckets = event_result["aggregations"]["identifier"]["buckets"]
+        for start in range(0, len(buckets), PAGE_SIZE):
+            yield buckets[start : start + PAGE_SIZE]
+        return
+
+    remaining = params.limit
+    after_key = None
+    while remaining is None or remaining > 0:
+        composite: dict = {
+            "size": min(PAGE_SIZE, remaining or PAGE_SIZE),
+            "sources": [{"identifier": {"terms": {"field": "identifier"}}}],
+        }
+        if after_key:
+            composite["after"] = after_key
+        event_query = {
+            "size": 0,
+            "query": query,
+            "aggs": {"identifier": {"composite": composite, **sub_aggs}},
+        }
+        event_result = search_events(os_client, event_query, deadline)
+        aggregation = event_result["aggregations"]["identifier"]
+        buckets = [
+            {**bucket, "key": bucket["key"]["identifier"]}
+            for bucket in aggregation["buckets"][:remaining]
+        ]
+        if not buckets:
+            return
+        yield buckets
+        if remaining is not None:
+            remaining -= len(buckets)
+        after_key = aggregation.get("after_key")
+        if not after_key:
+            return
+
+
+def prefetched(pages: Iterator):
+    """
+    Iterates pages while fetching the next one in a background thread, so that
+    fetching a page overlaps with processing the previous one.
+    """
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        # Run in a copy of the context so that slow request capture sees the searches
+        future = executor.submit(copy_context().run, next, pages, None)
+        while (page := future.result()) is not None:
+            future = executor.submit(copy_context().run, next, pages, None)
+            yield page
+
+
+def iter_reservation_events(
+    os_client: OpenSearch,
+    collection_name: str,
+    from_date: datetime.date | None = None,
+    to_date: datetime.date | None = None,
+    params: ReservationQuery | None = None,
+    work_data_source: Callable[[list[str]], dict] | None = None,
+    deadline: Deadline | None = None,
+):
+    """
+    Retrieves reservation events from OpenSearch on a given (or not given) date frame.
+    Generator version of `get_reservation_events`: buckets are aggregated page by
+    page and each page is enriched (while the next one is being fetched) and
+    yielded as finished reservations, so only one page is held in memory at a time.
+
+    NOTE: count order (the default) and min_count need a terms aggregation, which
+    OpenSearch can't page. Its buckets (up to `limit`) arrive in one search
+    response, only the enrichment and the rows after it are paged.
+    """
+
+    if not collection_name:
+        raise HTTPException(status_code=404, detail="Invalid collection configuration")
+
+    params = params or ReservationQuery()
+
+    if params.needs_work_data and work_data_source is None:
+        work_data_source = partial(get_work_data, os_client, deadline=deadline)
+
+    event_must = event_filters(collection_name, from_date, to_date, params)
+    pages = iter_identifier_buckets(os_client, event_must, params, deadline)
+
+    for identifier_buckets in prefetched(pages):
+        # Fetch work data for the page, unless only counts were requested
+        works_map = {}
+        if params.needs_work_data:
+            works_map = work_data_source(
+                [bucket["key"] for bucket in identifier_buckets]
+            )
+
+        for bucket in identifier_buckets:
+            yield Reservation(
+                identifier=bucket["key"],
+                count=bucket["doc_count"],
+                **params.work_fields(works_map.get(bucket["key"], {})),
+            )
+
+
 def get_reservation_events(
     os_client: OpenSearch,
     collection_name: str,
     from_date: datetime.date | None = None,
     to_date: datetime.date | None = None,
+    params: ReservationQuery | None = None,
+    work_data_source: Callable[[list[str]], dict] | None = None,
+    deadline: Deadline | None = None,
 ):
     """
     Retrieves reservation events from OpenSearch on a given (or not given) date frame
@@ -41,86 +333,251 @@ def get_reservation_events(
         (NOTE: events unfortunately don't have collection ids so we use name here)
     - from_date (datetime.date, optional): the start date for filtering
     - to_date (datetime.date, optional): the end date for filtering
+    - params (ReservationQuery, optional): sorting, filtering and limiting options
+    - work_data_source (callable, optional): function resolving identifiers to
+        title and author. Defaults to looking them up from the works index.
+    - deadline (Deadline, optional): the request's time budget. The aggregation
+        fails with 504 if it can't finish in time, enrichment is cut short instead.
 
     Returns:
     - Reservations: List of reservation events
     """
+    return list(
+        iter_reservation_events(
+            os_client=os_client,
+            collection_name=collection_name,
+            from_date=from_date,
+            to_date=to_date,
+            params=params,
+            work_data_source=work_data_source,
+            deadline=deadline,
+        )
+    )
+
+
+def iter_windowed_reservation_events(
+    os_client: OpenSearch,
+    collection_name: str,
+    windows: list[DateWindow],
+    params: ReservationQuery | None = None,
+    work_data_source: Callable[[list[str]], dict] | None = None,
+    deadline: Deadline | None = None,
+):
+    """
+    Retrieves reservation event counts for several date windows at once.
+
+    The windows are counted with a `filters` sub-aggregation of the identifier
+    aggregation, so all of them are aggregated in the same searches and each
+    identifier is enriched only once. Sorting and count filters apply to the
+    total count over all windows.
 
+    Parameters:
+    - os_client: OpenSearch client
+    - collection_name: (str): the name of the collection to filter by
+    - windows (list[DateWindow]): the date windows to count events in
+    - params (ReservationQuery, optional): sorting, filtering and limiting options
+    - work_data_source (callable, optional): function resolving identifiers to
+        title and author. Defaults to looking them up from the works index.
+    - deadline (Deadline, optional): the request's time budget
+
+    Yields:
+    - WindowedReservation for each identifier with events in any of the windows
+    """
     if not collection_name:
         raise HTTPException(status_code=404, detail="Invalid collection configuration")
 
-    # 1) Fetch identifier counts from hold events as aggregations
+    params = params or ReservationQuery()
 
-    event_must: list = [
-        {"term": {"type": "circulation_manager_hold_place"}},
-        {"term": {"collection": collection_name}},
-    ]
+    if params.needs_work_data and work_data_source is None:
+        work_data_source = partial(get_work_data, os_client, deadline=deadline)
 
-    if from_date or to_date:
-        range = {}
-        if from_date:
-            range["gte"] = from_date
-        if to_date:
-            range["lte"] = to_date
-        event_must.append({"range": {"start": range}})
+    window_filters = {
+        window.key: date_range_filter(window.from_date, window.to_date)
+        for window in windows
+    }
+    event_must = event_filters(collection_name, params=params)
+    event_must.append(
+        {"bool": {"should": list(window_filters.values()), "minimum_should_match": 1}}
+    )
+    sub_aggs = {"windows": {"filters": {"filters": window_filters}}}
+    pages = iter_identifier_buckets(os_client, event_must, params, deadline, sub_aggs)
 
-    event_query = {
+    for identifier_buckets in prefetched(pages):
+        works_map = {}
+        if params.needs_work_data:
+            works_map = work_data_source(
+                [bucket["key"] for bucket in identifier_buckets]
+            )
+
+        for bucket in identifier_buckets:
+            window_buckets = bucket["windows"]["buckets"]
+            yield WindowedReservation(
+                identifier=bucket["key"],
+                counts={
+                    window.key: window_buckets[window.key]["doc_count"]
+                    for window in windows
+                },
+                **params.work_fields(works_map.get(bucket["key"], {})),
+            )
+
+
+def get_reservation_events_for_identifier(
+    os_client: OpenSearch,
+    collection_name: str,
+    identifier: str,
+    from_date: datetime.date | None = None,
+    to_date: datetime.date | None = None,
+    interval: HistogramInterval | None = None,
+    work_data_source: Callable[[list[str]], dict] | None = None,
+    deadline: Deadline | None = None,
+):
+    """
+    Retrieves reservation event count for a single identifier, optionally as a
+    date histogram. The identifier is filtered in the event query, so the cost
+    doesn't depend on the size of the collection.
+
+    Parameters:
+    - os_client: OpenSearch client
+    - collection_name: (str): the name of the collection to filter by
+    - identifier (str): work's identifier (like ISBN)
+    - from_date (datetime.date, optional): the start date for filtering
+    - to_date (datetime.date, optional): the end date for filtering
+    - interval (HistogramInterval, optional): histogram bucket size, no histogram if not given
+    - work_data_source (callable, optional): function resolving identifiers to
+        title and author. Defaults to looking them up from the works index.
+    - deadline (Deadline, optional): the request's time budget
+
+    Returns:
+    - an object with reservation event count (and histogram) and work data
+    """
+    if not collection_name:
+        raise HTTPException(status_code=404, detail="Invalid collection configuration")
+
+    event_must = event_filters(collection_name, from_date, to_date)
+    event_must.append({"term": {"identifier": identifier}})
+    event_query: dict = {
         "size": 0,
+        "track_total_hits": True,
         "query": {"bool": {"must": event_must}},
-        "aggs": {"identifier": {"terms": {"field": "identifier", "size": 1000000}}},
     }
+    if interval:
+        event_query["aggs"] = {
+            "histogram": {
+                "date_histogram": {
+                    "field": "start",
+                    "calendar_interval": interval.value,
+                    "format": "yyyy-MM-dd",
+                }
+            }
+        }
+
+    event_result = search_events(os_client, event_query, deadline)
+    count = event_result["hits"]["total"]["value"]
+    if not count:
+        raise HTTPException(
+            status_code=404, detail=f"No reservations for Identifier {identifier}"
+        )
+
+    if work_data_source is None:
+        work_data_source = partial(get_work_data, os_client, deadline=deadline)
+    work = work_data_source([identifier]).get(identifier, {})
 
-    event_result = os_client.search(
-        index=settings.OPENSEARCH_EVENT_INDEX, body=event_query
+    result = IdentifierReservationHistory(
+        identifier=identifier,
+        count=count,
+        title=work.get("title", ""),
+        author=work.get("author", ""),
     )
+    if interval:
+        result.histogram = [
+            HistogramBucket(date=bucket["key_as_string"], count=bucket["doc_count"])
+            for bucket in event_result["aggregations"]["histogram"]["buckets"]
+        ]
+    return result
 
-    identifier_buckets = event_result["aggregations"]["identifier"]["buckets"]
-    identifiers = [bucket["key"] for bucket in identifier_buckets]
 
-    # 2) Fetch work data for each identifier from works index
+def get_first_event_date(os_client: OpenSearch) -> datetime.date | None:
+    """
+    Retrieves the day of the earliest hold event of all collections
+    """
+    event_query = {
+        "size": 0,
+        "query": {"term": {"type": "circulation_manager_hold_place"}},
+        "aggs": {"earliest": {"min": {"field": "start", "format": "yyyy-MM-dd"}}},
+    }
+    event_result = search(
+        os_client, index=settings.OPENSEARCH_EVENT_INDEX, body=event_query
+    )
+    earliest = event_result["aggregations"]["earliest"]
+    if earliest.get("value") is None:
+        return None
+    return datetime.date.fromisoformat(earliest["value_as_string"][:10])
 
-    source_fields = [
-        "identifiers",
-        "title",
-        "author",
-    ]
-    BATCH_SIZE = 10000
-    works_map = {}
 
-    while len(identifiers) > 0:
-        identifiers_to_fetch = identifiers[:BATCH_SIZE]
-        identifiers = identifiers[BATCH_SIZE:]
-        work_query = {
-            "size": BATCH_SIZE,
-            "_source": source_fields,
+def iter_daily_event_counts(
+    os_client: OpenSearch, from_date: datetime.date, to_date: datetime.date
+):
+    """
+    Retrieves daily hold event counts per identifier for all collections in one
+    grouped pass: a composite aggregation over collection, day and identifier,
+    paged with its after key.
+
+    Parameters:
+    - os_client: OpenSearch client
+    - from_date (datetime.date): the first day to count
+    - to_date (datetime.date): the day after the last day to count
+
+    Yields:
+    - pages of (collection_name, day, identifier, count) tuples
+    """
+    PAGE_SIZE = 10000
+    after_key = None
+    while True:
+        composite: dict = {
+            "size": PAGE_SIZE,
+            "sources": [
+                {"collection": {"terms": {"field": "collection"}}},
+                {
+                    "day": {
+                        "date_histogram": {
+                            "field": "start",
+                            "calendar_interval": "day",
+                            "format": "yyyy-MM-dd",
+                        }
+                    }
+                },
+                {"identifier": {"terms": {"field": "identifier"}}},
+            ],
+        }
+        if after_key:
+            composite["after"] = after_key
+        event_query = {
+            "size": 0,
             "query": {
-                "nested": {
-                    "path": "identifiers",
-                    "query": {
-                        "terms": {"identifiers.identifier": identifiers_to_fetch}
-                    },
+                "bool": {
+                    "must": [
+                        {"term": {"type": "circulation_manager_hold_place"}},
+                        {"range": {"start": {"gte": from_date, "lt": to_date}}},
+                    ]
                 }
             },
+            "aggs": {"rollup": {"composite": composite}},
         }
-        work_result = os_client.search(
-            index=settings.OPENSEARCH_WORK_INDEX, body=work_query
-        )
-
-        for hit in work_result.get("hits", {}).get("hits", []):
-            for identifier in hit.get("_source", {}).get("identifiers", []):
-                works_map[identifier["identifier"]] = hit["_source"]
-
-    # 3) Combine identifier counts with work data
-
-    def make_reservation_info(bucket):
-        work = works_map.get(bucket.get("key"), {})
-        return Reservation(
-            identifier=bucket.get("key"),
-            title=work.get("title", ""),
-            author=work.get("author", ""),
-            count=bucket.get("doc_count"),
+        event_result = search(
+            os_client, index=settings.OPENSEARCH_EVENT_INDEX, body=event_query
         )
-
-    data = [make_reservation_info(bucket) for bucket in identifier_buckets]
-
-    return data
+        aggregation = event_result["aggregations"]["rollup"]
+        if not aggregation["buckets"]:
+            return
+        yield [
+            (
+                bucket["key"]["collection"],
+                datetime.date.fromisoformat(bucket["key"]["day"][:10]),
+                bucket["key"]["identifier"],
+                bucket["doc_count"],
+            )
+            for bucket in aggregation["buckets"]
+        ]
+        after_key = aggregation.get("after_key")
+        if not after_key:
+            return
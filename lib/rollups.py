@@ -0,0 +1,361 @@
+"""
+Collection-wide rollups of hold counts and daily reservation event counts,
+computed for all collections in one grouped pass and stored in a local SQLite
+file. The endpoints serve requests from the rollups when they cover them.
+
+Refresh them in the background by setting ROLLUP_PATH, or once (e.g. from cron
+before the nightly reporting window) with:
+
+    poetry run python -m lib.rollups
+"""
+
+import datetime
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+from config import settings
+from lib.database import SessionLocal, get_hold_counts_by_collection
+from lib.holds_history import HoldsHistoryStore, holds_history, record_holds_snapshot
+from lib.local_store import SQLiteConnections, file_lock
+from lib.models import Reservation, ReservationQuery, ReservationSort
+from lib.opensearch import (
+    get_first_event_date,
+    get_os_client,
+    iter_daily_event_counts,
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS hold_counts (
+    collection_id INTEGER NOT NULL,
+    identifier TEXT NOT NULL,
+    title TEXT NOT NULL,
+    author TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (collection_id, identifier, title, author)
+);
+CREATE TABLE IF NOT EXISTS event_counts (
+    collection TEXT NOT NULL,
+    day INTEGER NOT NULL,
+    identifier TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (collection, day, identifier)
+);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value REAL NOT NULL);
+"""
+
+
+class RollupStore:
+    """
+    SQLite file holding the rollups, shared by all workers on the host.
+
+    `meta` records when hold counts were computed and which days the event
+    counts cover: `events_last_day` is the last complete day counted, and no
+    events exist before `events_first_day`.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connections = SQLiteConnections(path, SCHEMA, timeout=30)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def _connection(self) -> sqlite3.Connection:
+        return self._connections.get()
+
+    @contextmanager
+    def _transaction(self):
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN")
+            yield connection
+
+    @contextmanager
+    def lock(self):
+        """
+        Takes the refresh lock without waiting. Yields whether it was taken, so
+        that only one of the workers sharing the store refreshes it.
+        """
+        with file_lock(self.path + ".lock") as locked:
+            yield locked
+
+    def meta(self) -> dict[str, float]:
+        return dict(self._connection().execute("SELECT key, value FROM meta"))
+
+    def replace_hold_counts(self, rows, computed_at: float):
+        """
+        Replaces the hold counts of all collections. Rows that only differ by a
+        missing or empty title or author are summed.
+
+        Parameters:
+        - rows: (collection_id, identifier, title, author, count) tuples
+        - computed_at (float): unix time the counts were queried at
+        """
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM hold_counts")
+            connection.executemany(
+                "INSERT INTO hold_counts VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (collection_id, identifier, title, author) "
+                "DO UPDATE SET count = count + excluded.count",
+                (
+                    (collection_id, identifier, title or "", author or "", count)
+                    for collection_id, identifier, title, author, count in rows
+                ),
+            )
+            connection.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('holds_computed_at', ?)",
+                [computed_at],
+            )
+
+    def replace_event_counts(
+        self, pages, first_day: datetime.date, last_day: datetime.date
+    ):
+        """
+        Replaces the event counts of days from `first_day` onwards and extends
+        the covered range up to `last_day`.
+
+        Parameters:
+        - pages: pages of (collection_name, day, identifier, count) tuples
+        - first_day (datetime.date): the first day the pages count
+        - last_day (datetime.date): the last day the pages count
+        """
+        with self._transaction() as connection:
+            connection.execute(
+                "DELETE FROM event_counts WHERE day >= ?", [first_day.toordinal()]
+            )
+            for rows in pages:
+                connection.executemany(
+                    "INSERT INTO event_counts VALUES (?, ?, ?, ?)",
+                    (
+                        (collection, day.toordinal(), identifier, count)
+                        for collection, day, identifier, count in rows
+                    ),
+                )
+            connection.execute(
+                "INSERT OR IGNORE INTO meta VALUES ('events_first_day', ?)",
+                [first_day.toordinal()],
+            )
+            connection.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('events_last_day', ?)",
+                [last_day.toordinal()],
+            )
+
+    def _query_counts(
+        self,
+        table_query: str,
+        arguments: list,
+        params: ReservationQuery,
+        group_by: str,
+        count: str,
+        default_sort: ReservationSort,
+    ):
+        """
+        Runs a grouped count query with the sorting and filtering options applied.
+        `default_sort` is the order of the live query the rollup stands in for.
+        """
+        sql = table_query
+        if params.identifier_prefix:
+            sql += " AND substr(identifier, 1, ?) = ?"
+            arguments += [len(params.identifier_prefix), params.identifier_prefix]
+        sql += f" GROUP BY {group_by}"
+        if params.min_count:
+            sql += f" HAVING {count} >= ?"
+            arguments.append(params.min_count)
+        if (params.sort or default_sort) == ReservationSort.count_desc:
+            sql += f" ORDER BY {count} DESC, identifier"
+        else:
+            sql += " ORDER BY identifier"
+        if params.limit:
+            sql += " LIMIT ?"
+            arguments.append(params.limit)
+        return self._connection().execute(sql, arguments).fetchall()
+
+    def read_hold_counts(
+        self, collection_id: int, params: ReservationQuery, max_age: float
+    ) -> tuple[list[Reservation], float] | None:
+        """
+        Reads a collection's active reservation counts with edition data, and
+        the unix time they were computed at. Returns None if the rollup is
+        older than `max_age` seconds (0 never serves it).
+        """
+        if not self.enabled or max_age <= 0:
+            return None
+        computed_at = self.meta().get("holds_computed_at")
+        if computed_at is None or time.time() - computed_at > max_age:
+            return None
+
+        # Like the live query, counts are only split by edition when it's shown
+        rows = self._query_counts(
+            "SELECT SUM(count), identifier, title, author FROM hold_counts "
+            "WHERE collection_id = ?",
+            [collection_id],
+            params,
+            group_by=(
+                "identifier, title, author" if params.needs_work_data else "identifier"
+            ),
+            count="SUM(count)",
+            default_sort=ReservationSort.identifier,
+        )
+        reservations = [
+            Reservation(
+                count=count,
+                identifier=identifier,
+                **params.work_fields({"title": title, "author": author}),
+            )
+            for count, identifier, title, author in rows
+        ]
+        return reservations, computed_at
+
+    def read_event_counts(
+        self,
+        collection_name: str,
+        from_date: datetime.date | None,
+        to_date: datetime.date | None,
+        params: ReservationQuery,
+    ) -> list[tuple[str, int]] | None:
+        """
+        Reads a collection's reservation event counts per identifier within the
+        date frame, or None if the rollup doesn't cover it.
+
+        Like the live query (where OpenSearch rounds a date-only `lte` up to the
+        end of the day), `to_date` is included, so it must have been rolled up.
+        """
+        if not self.enabled:
+            return None
+        last_day = self.meta().get("events_last_day")
+        if to_date is None or last_day is None or to_date.toordinal() > last_day:
+            return None
+
+        arguments: list = [collection_name, to_date.toordinal()]
+        table_query = (
+            "SELECT SUM(count), identifier FROM event_counts "
+            "WHERE collection = ? AND day <= ?"
+        )
+        if from_date:
+            table_query += " AND day >= ?"
+            arguments.append(from_date.toordinal())
+
+        rows = self._query_counts(
+            table_query,
+            arguments,
+            params,
+            group_by="identifier",
+            count="SUM(count)",
+            default_sort=ReservationSort.count_desc,
+        )
+        return [(identifier, count) for count, identifier in rows]
+
+
+rollups = RollupStore(settings.ROLLUP_PATH)
+
+
+def read_reservation_events(
+    store: RollupStore,
+    collection_name: str,
+    from_date: datetime.date | None,
+    to_date: datetime.date | None,
+    params: ReservationQuery,
+    work_data_source: Callable[[list[str]], dict],
+) -> list[Reservation] | None:
+    """
+    Serves reservation history from the rollup, enriched with work data.
+
+    Returns:
+    - the reservations, or None if the rollup doesn't cover the date frame
+    """
+    counts = store.read_event_counts(collection_name, from_date, to_date, params)
+    if counts is None:
+        return None
+
+    PAGE_SIZE = 10000
+    reservations = []
+    for start in range(0, len(counts), PAGE_SIZE):
+        page = counts[start : start + PAGE_SIZE]
+        works_map = {}
+        if params.needs_work_data:
+            works_map = work_data_source([identifier for identifier, _ in page])
+        reservations.extend(
+            Reservation(
+                identifier=identifier,
+                count=count,
+                **params.work_fields(works_map.get(identifier, {})),
+            )
+            for identifier, count in page
+        )
+    return reservations
+
+
+def refresh_rollups(
+    db, os_client, store: RollupStore, today: datetime.date, hold_counts=None
+):
+    """
+    Recomputes the hold counts of all collections and rolls up the reservation
+    events of all collections up to yesterday. The last rolled up day is counted
+    again to pick up events indexed late.
+
+    Parameters:
+    - today (datetime.date): the current UTC day, as events are dated in UTC
+    - hold_counts: rows of `get_hold_counts_by_collection` already queried,
+      queried from `db` if not given
+    """
+    if hold_counts is None:
+        hold_counts = get_hold_counts_by_collection(db)
+    store.replace_hold_counts(hold_counts, time.time())
+
+    yesterday = today - datetime.timedelta(days=1)
+    last_day = store.meta().get("events_last_day")
+    if last_day is not None:
+        first_day = datetime.date.fromordinal(int(last_day))
+    else:
+        first_day = get_first_event_date(os_client) or yesterday
+    if first_day > yesterday:
+        return
+
+    store.replace_event_counts(
+        iter_daily_event_counts(os_client, first_day, today), first_day, yesterday
+    )
+
+
+def refresh_scheduled_rollups(
+    store: RollupStore, interval: float, snapshots: HoldsHistoryStore | None = None
+) -> bool:
+    """
+    Refreshes the rollups unless another worker is refreshing them or they were
+    refreshed during this interval. The hold counts queried for them also
+    record today's snapshot in `snapshots` when it is enabled, so that the
+    grouped hold query runs once for both.
+
+    Returns:
+    - whether the rollups were refreshed
+    """
+    with store.lock() as locked:
+        computed_at = store.meta().get("holds_computed_at") if locked else None
+        if not locked or (computed_at and time.time() - computed_at < interval * 0.9):
+            return False
+
+        db = SessionLocal()
+        os_client_dependency = get_os_client()
+        try:
+            hold_counts = get_hold_counts_by_collection(db)
+            refresh_rollups(
+                db,
+                next(os_client_dependency),
+                store,
+                datetime.datetime.now(datetime.timezone.utc).date(),
+                hold_counts,
+            )
+            if snapshots is not None and snapshots.enabled:
+                record_holds_snapshot(db, snapshots, datetime.date.today(), hold_counts)
+        finally:
+            db.close()
+            os_client_dependency.close()
+        return True
+
+
+if __name__ == "__main__":
+    if not rollups.enabled:
+        raise SystemExit("ROLLUP_PATH is not set")
+    refresh_scheduled_rollups(rollups, interval=0, snapshots=holds_history)
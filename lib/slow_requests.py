@@ -0,0 +1,143 @@
+import datetime
+import logging
+import time
+from collections import deque
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Backend queries made while handling the current request, None when not capturing
+_queries: ContextVar[list | None] = ContextVar("slow_request_queries", default=None)
+
+# Statements touching these tables have their parameters (API tokens) redacted
+REDACTED_TABLES = ("apitokens",)
+
+
+class SlowRequestLog:
+    """
+    Bounded ring buffer of requests that took longer than the threshold, with
+    the SQL statements and OpenSearch bodies they ran. Optionally each sample
+    also gets the statements' EXPLAIN (ANALYZE, BUFFERS) plans and the search
+    bodies' profiles, which are collected after the response has been sent.
+
+    NOTE: every worker process keeps its own buffer.
+    """
+
+    def __init__(self, threshold: float, size: int):
+        self.threshold = threshold
+        self.samples: deque = deque(maxlen=size)
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def start(self) -> list:
+        """
+        Starts capturing backend queries made in the current context.
+        """
+        queries: list = []
+        _queries.set(queries)
+        return queries
+
+    def add(self, sample: dict):
+        self.samples.append(sample)
+        logger.warning(
+            "Slow request %s %s took %.3fs with %d queries",
+            sample["method"],
+            sample["path"],
+            sample["duration"],
+            len(sample["queries"]),
+        )
+
+
+slow_requests = SlowRequestLog(
+    settings.SLOW_REQUEST_THRESHOLD, settings.SLOW_REQUEST_BUFFER_SIZE
+)
+
+
+def record_search(index: str, body: dict, duration: float):
+    """
+    Records an OpenSearch search made while capturing.
+    """
+    queries = _queries.get()
+    if queries is not None:
+        queries.append(
+            {"type": "opensearch", "index": index, "body": body, "duration": duration}
+        )
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _queries.get() is not None:
+        conn.info.setdefault("slow_request_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    queries = _queries.get()
+    if queries is None or not conn.info.get("slow_request_start"):
+        return
+    duration = time.perf_counter() - conn.info["slow_request_start"].pop()
+    redacted = any(table in statement for table in REDACTED_TABLES)
+    queries.append(
+        {
+            "type": "sql",
+            "dialect": conn.dialect.name,
+            "statement": statement,
+            "parameters": None if redacted else parameters,
+            "redacted": redacted,
+            "duration": duration,
+        }
+    )
+
+
+def make_sample(request, status_code: int, duration: float, queries: list) -> dict:
+    return {
+        "time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "method": request.method,
+        "path": request.url.path,
+        "query_string": request.url.query,
+        "status_code": status_code,
+        "duration": duration,
+        "queries": queries,
+    }
+
+
+def analyze_sample(sample: dict, engine, os_client):
+    """
+    Adds query plans and search profiles to a sample (as configured) and stores it.
+    Runs the queries again, so it is called after the response has been sent.
+
+    Parameters:
+    - sample (dict): the slow request sample
+    - engine: SQLAlchemy engine to run EXPLAIN with
+    - os_client: OpenSearch client to run profiled searches with
+    """
+    for query in sample["queries"]:
+        try:
+            if (
+                query["type"] == "sql"
+                and settings.SLOW_REQUEST_EXPLAIN
+                and not query["redacted"]
+                and query["dialect"] == "postgresql"
+            ):
+                with engine.connect() as connection:
+                    plan = connection.exec_driver_sql(
+                        "EXPLAIN (ANALYZE, BUFFERS) " + query["statement"],
+                        query["parameters"],
+                    )
+                    query["explain"] = "\n".join(row[0] for row in plan)
+            elif query["type"] == "opensearch" and settings.SLOW_REQUEST_PROFILE:
+                result = os_client.search(
+                    index=query["index"], body={**query["body"], "profile": True}
+                )
+                query["profile"] = result.get("profile")
+        except Exception:
+            logger.warning("Analyzing slow request query failed", exc_info=True)
+
+    slow_requests.add(sample)
@@ -1,51 +1,348 @@
 import datetime
-from fastapi import FastAPI, Depends, HTTPException, Query, Request, Security
+import secrets
+import time
+from contextlib import asynccontextmanager
+from functools import partial
+from itertools import chain
+from typing import Callable, Iterator
+
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response, Security
+from fastapi.responses import StreamingResponse
 from fastapi.security import APIKeyHeader
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 from opensearchpy import OpenSearch
+from pydantic import BaseModel
 from sqlalchemy.orm import Session
 
 from config import settings
+from lib.cache import (
+    cache,
+    cached_reservations,
+    cached_work_data,
+    response_cache_key,
+    token_cache_key,
+)
 from lib.database import (
+    engine,
     get_api_token,
     get_db,
+    get_edition_data,
     get_holds_with_edition_data,
     get_reservations_for_identifier,
 )
-from lib.models import Reservation, TokenData
-from lib.opensearch import get_os_client, get_reservation_events
+from lib.deadline import Deadline
+from lib.holds_history import holds_history, record_todays_holds_snapshot
+from lib.local_store import PeriodicTask
+from lib.models import (
+    DateWindow,
+    HistogramInterval,
+    IdentifierReservationHistory,
+    HoldCountSnapshot,
+    Reservation,
+    ReservationField,
+    ReservationQuery,
+    ReservationSort,
+    TokenData,
+    WindowedReservation,
+)
+from lib.opensearch import (
+    get_os_client,
+    get_reservation_events,
+    get_reservation_events_for_identifier,
+    get_work_data,
+    iter_reservation_events,
+    iter_windowed_reservation_events,
+)
+from lib.rollups import (
+    read_reservation_events,
+    refresh_scheduled_rollups,
+    rollups,
+)
+from lib.slow_requests import analyze_sample, make_sample, slow_requests
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Runs the rollup refreshes and the daily active hold count snapshots in the
+    background when enabled. With rollups, each refresh also records the day's
+    snapshot from the same hold count query.
+    """
+    task = None
+    if rollups.enabled:
+        task = PeriodicTask(
+            partial(
+                refresh_scheduled_rollups,
+                rollups,
+                settings.ROLLUP_REFRESH_INTERVAL,
+                snapshots=holds_history,
+            ),
+            settings.ROLLUP_REFRESH_INTERVAL,
+            "Refreshing rollups",
+        )
+    elif holds_history.enabled:
+        task = PeriodicTask(
+            partial(record_todays_holds_snapshot, holds_history),
+            settings.HOLDS_SNAPSHOT_CHECK_INTERVAL,
+            "Recording hold count snapshot",
+        )
+    if task:
+        task.start()
+    yield
+    if task:
+        task.stop()
+
 
 app = FastAPI(
     title="E-kirjasto Data API",
     root_path=settings.ROOT_PATH,
     version="1.0.2",
+    lifespan=lifespan,
 )
 
 
+# SLOW REQUEST CAPTURE
+
+
+def analyze_slow_request(sample: dict):
+    os_client_dependency = get_os_client()
+    try:
+        analyze_sample(sample, engine, next(os_client_dependency))
+    finally:
+        os_client_dependency.close()
+
+
+@app.middleware("http")
+async def capture_slow_requests(request: Request, call_next):
+    """
+    Captures requests slower than SLOW_REQUEST_THRESHOLD with the backend queries
+    they made. The duration is measured once the whole body has been sent, so it
+    includes generating streamed responses. Plans and profiles are collected
+    after that.
+    """
+    if not slow_requests.enabled:
+        return await call_next(request)
+
+    queries = slow_requests.start()
+    start = time.perf_counter()
+    response = await call_next(request)
+
+    async def capture_if_slow():
+        duration = time.perf_counter() - start
+        if duration >= slow_requests.threshold:
+            sample = make_sample(request, response.status_code, duration, queries)
+            await run_in_threadpool(analyze_slow_request, sample)
+
+    response.background = BackgroundTask(capture_if_slow)
+    return response
+
+
+# Header set on responses whose results are incomplete because the request
+# deadline ran out (counts are complete, but title and author may be empty)
+PARTIAL_RESPONSE_HEADER = "X-Partial-Response"
+
+# Header set on responses served from a precomputed rollup, telling when (in
+# UTC) the counts were computed
+DATA_AS_OF_HEADER = "X-Data-As-Of"
+
+
+# Rows serialized per chunk of a streamed response
+STREAM_CHUNK_SIZE = 1000
+
+
+def stream_json_array(rows: Iterator[BaseModel]):
+    """
+    Serializes rows into a JSON array chunk by chunk as they are computed, so
+    that the whole result is never held in memory. Rows are serialized like
+    the routes' `response_model_exclude_unset=True`.
+    """
+    yield "["
+    chunk = []
+    for number, row in enumerate(rows):
+        chunk.append(("," if number else "") + row.model_dump_json(exclude_unset=True))
+        if len(chunk) == STREAM_CHUNK_SIZE:
+            yield "".join(chunk)
+            chunk = []
+    yield "".join(chunk) + "]"
+
+
+def get_deadline() -> Deadline:
+    """
+    A dependency function returning the time budget of the request.
+    Authentication depends on this, so the budget starts before it.
+    """
+    return Deadline(settings.REQUEST_DEADLINE)
+
+
 # AUTHENTICATION
 
 api_key_header = APIKeyHeader(name="Token")
 
 
 def get_token_data(
-    db: Session = Depends(get_db), api_key: str = Security(api_key_header)
-):
+    deadline: Deadline = Depends(get_deadline),
+    db: Session = Depends(get_db),
+    api_key: str = Security(api_key_header),
+) -> TokenData:
     """
     A dependency function to get token data from the database using the provided API key.
     NOTE: A route gets authenticated when it depends on this function
 
     Parameters (given by dependencies):
+    - deadline (Deadline): The time budget of the request.
     - db (Session): The database session to query.
     - api_key (str): The API key provided for authentication.
 
     Returns:
     - The token data associated with the provided API key.
+
+    NOTE: Cached tokens are accepted for TOKEN_CACHE_TTL seconds without checking
+    the database, so revoking a token takes effect when its cache entry expires.
     """
-    token_data = get_api_token(db, api_key)
-    if not token_data:
+    cache_key = token_cache_key(api_key)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return TokenData.model_validate_json(cached).model_copy(
+            update={"token": api_key}
+        )
+
+    result = get_api_token(db, api_key)
+    if not result:
         raise HTTPException(status_code=404, detail="Invalid api token")
+    if deadline.expired:
+        raise HTTPException(status_code=504, detail="Request deadline exceeded")
+
+    token_data = TokenData(
+        id=result.id,
+        label=result.label,
+        token=api_key,
+        collection_id=result.collection_id,
+        collection_name=result.collection_name,
+    )
+    # The token itself is left out, cache keys and values are stored on disk
+    cache.set(
+        cache_key,
+        token_data.model_copy(update={"token": ""}).model_dump_json().encode(),
+        ttl=settings.TOKEN_CACHE_TTL,
+    )
     return token_data
 
 
+admin_token_header = APIKeyHeader(name="Admin-Token", auto_error=False)
+
+
+def require_admin(admin_token: str | None = Security(admin_token_header)):
+    """
+    A dependency function authenticating admin routes with ADMIN_TOKEN.
+    The routes don't exist (404) when no admin token has been configured.
+    """
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not admin_token or not secrets.compare_digest(admin_token, settings.ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Not authenticated")
+
+
+def get_reservation_query(
+    sort: ReservationSort | None = Query(
+        default=None,
+        description="Sort order of the results. Defaults to count_desc for "
+        "reservation history and to identifier for active reservations.",
+    ),
+    limit: int | None = Query(
+        default=None, ge=1, description="Maximum number of results to return"
+    ),
+    min_count: int | None = Query(
+        default=None, ge=1, description="Only return results with at least this count"
+    ),
+    identifier_prefix: str | None = Query(
+        default=None,
+        min_length=1,
+        description="Only return identifiers starting with this prefix",
+    ),
+    fields: str | None = Query(
+        default=None,
+        description="Comma separated list of fields to return "
+        "(identifier, count, title, author). "
+        "identifier and count are always included. "
+        "Leaving out title and author skips looking up work data.",
+    ),
+) -> ReservationQuery:
+    """
+    A dependency function collecting the sorting, filtering and field selection
+    query parameters shared by the reservation listing routes.
+    """
+    selected_fields = None
+    if fields is not None:
+        selected_fields = set()
+        for name in filter(None, (name.strip() for name in fields.split(","))):
+            try:
+                selected_fields.add(ReservationField(name))
+            except ValueError:
+                raise HTTPException(status_code=422, detail=f"Invalid field: {name}")
+
+    return ReservationQuery(
+        sort=sort,
+        limit=limit,
+        min_count=min_count,
+        identifier_prefix=identifier_prefix,
+        fields=selected_fields,
+    )
+
+
+MAX_WINDOWS = 24
+
+
+def get_windows(
+    window: list[str] = Query(
+        description="Date window as FROM/TO (format: YYYY-MM-DD/YYYY-MM-DD, "
+        "either end may be left out). Repeat for each window.",
+    ),
+) -> list[DateWindow]:
+    """
+    A dependency function parsing the date windows of a multi-window query.
+    """
+    if len(window) > MAX_WINDOWS:
+        raise HTTPException(
+            status_code=422, detail=f"At most {MAX_WINDOWS} windows are allowed"
+        )
+
+    windows = []
+    for key in dict.fromkeys(window):
+        from_date, separator, to_date = key.partition("/")
+        try:
+            if not separator or not (from_date or to_date):
+                raise ValueError
+            date_window = DateWindow(
+                key=key,
+                from_date=datetime.date.fromisoformat(from_date) if from_date else None,
+                to_date=datetime.date.fromisoformat(to_date) if to_date else None,
+            )
+            if from_date and to_date and date_window.from_date > date_window.to_date:
+                raise ValueError
+            windows.append(date_window)
+        except ValueError:
+            raise HTTPException(status_code=422, detail=f"Invalid window: {key}")
+    return windows
+
+
+def get_work_data_source(
+    db: Session = Depends(get_db),
+    os_client: OpenSearch = Depends(get_os_client),
+    deadline: Deadline = Depends(get_deadline),
+) -> Callable[[list[str]], dict]:
+    """
+    A dependency function returning the configured enrichment backend: a function
+    resolving identifiers to title and author either from Postgres editions or
+    from the OpenSearch works index, within the request's deadline.
+    """
+    if settings.ENRICHMENT_BACKEND == "postgres":
+        source = partial(get_edition_data, db, deadline=deadline)
+    else:
+        source = partial(get_work_data, os_client, deadline=deadline)
+    return partial(cached_work_data, source, deadline=deadline)
+
+
 # ROUTES
 
 
@@ -57,14 +354,73 @@ def read_root(request: Request):
     }
 
 
-@app.get("/active-reservations")
+@app.get("/active-reservations", response_model_exclude_unset=True)
 def read_active_reservations(
-    db: Session = Depends(get_db), token_data: TokenData = Depends(get_token_data)
+    response: Response,
+    db: Session = Depends(get_db),
+    params: ReservationQuery = Depends(get_reservation_query),
+    token_data: TokenData = Depends(get_token_data),
 ) -> list[Reservation]:
-    result = get_holds_with_edition_data(db=db, collection_id=token_data.collection_id)
+    """
+    When ROLLUP_HOLDS_MAX_AGE is set, the counts may be served from the hold
+    count rollup. The X-Data-As-Of header then tells when they were computed.
+    """
+    rolled_up = rollups.read_hold_counts(
+        token_data.collection_id, params, max_age=settings.ROLLUP_HOLDS_MAX_AGE
+    )
+    if rolled_up is not None:
+        result, computed_at = rolled_up
+        response.headers[DATA_AS_OF_HEADER] = datetime.datetime.fromtimestamp(
+            computed_at, datetime.timezone.utc
+        ).isoformat(timespec="seconds")
+    else:
+        result = cached_reservations(
+            response_cache_key(
+                "active-reservations",
+                token_data.collection_id,
+                params.model_dump_json(),
+            ),
+            lambda: get_holds_with_edition_data(
+                db=db, collection_id=token_data.collection_id, params=params
+            ),
+        )
     return result
 
 
+@app.get("/active-reservations/history")
+def read_active_reservations_history(
+    from_date: datetime.date | None = Query(
+        default=None,
+        alias="from",
+        description="Format: YYYY-MM-DD",
+    ),
+    to_date: datetime.date | None = Query(
+        default=None,
+        alias="to",
+        description="Format: YYYY-MM-DD",
+    ),
+    identifier: list[str] | None = Query(
+        default=None,
+        description="Identifiers to include (repeatable). "
+        "Days on which they had no active holds are included with a count of 0.",
+    ),
+    token_data: TokenData = Depends(get_token_data),
+) -> list[HoldCountSnapshot]:
+    """
+    Daily active reservation counts recorded from the hold queue.
+    """
+    if not holds_history.enabled:
+        raise HTTPException(
+            status_code=404, detail="Active reservation history is not enabled"
+        )
+    return holds_history.read(
+        collection_id=token_data.collection_id,
+        from_date=from_date,
+        to_date=to_date,
+        identifiers=identifier,
+    )
+
+
 @app.get("/active-reservations/{id}")
 def read_active_reservations_for_license_pool(
     id: str,
@@ -77,8 +433,9 @@ def read_active_reservations_for_license_pool(
     return result
 
 
-@app.get("/reservation-history")
+@app.get("/reservation-history", response_model_exclude_unset=True)
 def read_reservation_history(
+    response: Response,
     os_client: OpenSearch = Depends(get_os_client),
     from_date: datetime.date | None = Query(
         default=None,
@@ -90,11 +447,154 @@ def read_reservation_history(
         alias="to",
         description="Format: YYYY-MM-DD",
     ),
+    params: ReservationQuery = Depends(get_reservation_query),
+    work_data_source: Callable[[list[str]], dict] = Depends(get_work_data_source),
+    deadline: Deadline = Depends(get_deadline),
     token_data: TokenData = Depends(get_token_data),
 ) -> list[Reservation]:
-    return get_reservation_events(
+    """
+    If looking up titles and authors doesn't fit in the request deadline, the
+    counts are returned with empty title and author and the X-Partial-Response
+    header set.
+
+    Date frames ending before today are counted from the rollups when enabled.
+
+    Without the response cache, counts-only requests (`fields` without title and
+    author) are streamed as they are computed. They can't be partial, and if a
+    later page misses the deadline the transfer is aborted instead of completed.
+    Requests with titles and authors are collected first, so that the header can
+    mark them partial.
+    """
+    result = read_reservation_events(
+        rollups,
+        collection_name=token_data.collection_name,
+        from_date=from_date,
+        to_date=to_date,
+        params=params,
+        work_data_source=work_data_source,
+    )
+    if result is None and not cache.enabled and not params.needs_work_data:
+        rows = iter_reservation_events(
+            os_client=os_client,
+            collection_name=token_data.collection_name,
+            from_date=from_date,
+            to_date=to_date,
+            params=params,
+            work_data_source=work_data_source,
+            deadline=deadline,
+        )
+        # Errors of the first page (like 504) are still returned as such,
+        # once streaming has started the status and headers have been sent
+        first = next(rows, None)
+        if first is None:
+            return []
+        return StreamingResponse(
+            stream_json_array(chain([first], rows)), media_type="application/json"
+        )
+    if result is None:
+        result = cached_reservations(
+            response_cache_key(
+                "reservation-history",
+                token_data.collection_name,
+                from_date,
+                to_date,
+                params.model_dump_json(),
+            ),
+            lambda: get_reservation_events(
+                os_client=os_client,
+                collection_name=token_data.collection_name,
+                from_date=from_date,
+                to_date=to_date,
+                params=params,
+                work_data_source=work_data_source,
+                deadline=deadline,
+            ),
+            deadline=deadline,
+        )
+    if deadline.partial:
+        response.headers[PARTIAL_RESPONSE_HEADER] = "true"
+    return result
+
+
+@app.get("/reservation-history/windows", response_model_exclude_unset=True)
+def read_reservation_history_windows(
+    response: Response,
+    os_client: OpenSearch = Depends(get_os_client),
+    windows: list[DateWindow] = Depends(get_windows),
+    params: ReservationQuery = Depends(get_reservation_query),
+    work_data_source: Callable[[list[str]], dict] = Depends(get_work_data_source),
+    deadline: Deadline = Depends(get_deadline),
+    token_data: TokenData = Depends(get_token_data),
+) -> list[WindowedReservation]:
+    """
+    Reservation counts for several date windows side by side, counted in one
+    aggregation. `counts` maps each window (as given) to its count. Sorting
+    and count filters apply to the events in any window, counting events in
+    overlapping windows once.
+    """
+    result = list(
+        iter_windowed_reservation_events(
+            os_client=os_client,
+            collection_name=token_data.collection_name,
+            windows=windows,
+            params=params,
+            work_data_source=work_data_source,
+            deadline=deadline,
+        )
+    )
+    if deadline.partial:
+        response.headers[PARTIAL_RESPONSE_HEADER] = "true"
+    return result
+
+
+@app.get("/reservation-history/{id}", response_model_exclude_unset=True)
+def read_reservation_history_for_identifier(
+    id: str,
+    response: Response,
+    os_client: OpenSearch = Depends(get_os_client),
+    from_date: datetime.date | None = Query(
+        default=None,
+        alias="from",
+        description="Format: YYYY-MM-DD",
+    ),
+    to_date: datetime.date | None = Query(
+        default=None,
+        alias="to",
+        description="Format: YYYY-MM-DD",
+    ),
+    interval: HistogramInterval | None = Query(
+        default=None,
+        description="Include reservation counts per interval as a histogram",
+    ),
+    work_data_source: Callable[[list[str]], dict] = Depends(get_work_data_source),
+    deadline: Deadline = Depends(get_deadline),
+    token_data: TokenData = Depends(get_token_data),
+) -> IdentifierReservationHistory:
+    result = get_reservation_events_for_identifier(
         os_client=os_client,
         collection_name=token_data.collection_name,
+        identifier=id,
         from_date=from_date,
         to_date=to_date,
+        interval=interval,
+        work_data_source=work_data_source,
+        deadline=deadline,
     )
+    if deadline.partial:
+        response.headers[PARTIAL_RESPONSE_HEADER] = "true"
+    return result
+
+
+# ADMIN ROUTES
+
+
+@app.get(
+    "/admin/slow-requests",
+    include_in_schema=False,
+    dependencies=[Depends(require_admin)],
+)
+def read_slow_requests() -> list[dict]:
+    """
+    Captured slow requests of this worker, oldest first.
+    """
+    return list(slow_requests.samples)
@@ -71,6 +71,14 @@ TEST_EDITIONS = [
         "author": "test author 2",  # Same author as book B
         "primary_identifier_id": 3,
     },
+    {
+        # Another data source's edition of book A, not the presentation edition
+        "id": 4,
+        "permanent_work_id": 1,
+        "title": "Other source title A",
+        "author": "other source author",
+        "primary_identifier_id": 1,
+    },
 ]
 
 TEST_INTEGRATION_CONFIGURATIONS = [
@@ -1,5 +1,6 @@
 from unittest.mock import MagicMock
 from config import settings
+from benchmarks.loadtest.stub_opensearch import add_window_counts
 
 mock_event_response = {
     "hits": {"total": {"value": 7, "relation": "eq"}, "hits": []},
@@ -71,9 +72,91 @@ mock_works_response = {
 }
 
 
+def mock_terms_event_response(aggs):
+    """
+    The mock event response, with window counts if they were requested.
+    """
+    buckets = mock_event_response["aggregations"]["identifier"]["buckets"]
+    aggregation = {
+        **mock_event_response["aggregations"]["identifier"],
+        "buckets": add_window_counts([dict(bucket) for bucket in buckets], aggs),
+    }
+    return {**mock_event_response, "aggregations": {"identifier": aggregation}}
+
+
+def mock_composite_event_response(aggs):
+    """
+    The same buckets as a composite aggregation page. The page after them is empty.
+    """
+    buckets = mock_event_response["aggregations"]["identifier"]["buckets"]
+    if "after" in aggs["composite"]:
+        buckets = []
+    aggregation = {
+        "buckets": add_window_counts(
+            [
+                {"key": {"identifier": bucket["key"]}, "doc_count": bucket["doc_count"]}
+                for bucket in buckets
+            ],
+            aggs,
+        )
+    }
+    if buckets:
+        aggregation["after_key"] = {"identifier": buckets[-1]["key"]}
+    return {**mock_event_response, "aggregations": {"identifier": aggregation}}
+
+
+def mock_paged_event_response(aggs):
+    """
+    The same buckets as composite aggregation pages of two and one buckets.
+    """
+    buckets = mock_event_response["aggregations"]["identifier"]["buckets"]
+    after = aggs["composite"].get("after", {}).get("identifier")
+    if after is None:
+        buckets = buckets[:2]
+    else:
+        keys = [bucket["key"] for bucket in buckets]
+        position = keys.index(after)
+        buckets = buckets[position + 1 :][:2]
+    aggregation = {
+        "buckets": [
+            {"key": {"identifier": bucket["key"]}, "doc_count": bucket["doc_count"]}
+            for bucket in buckets
+        ]
+    }
+    if buckets:
+        aggregation["after_key"] = {"identifier": buckets[-1]["key"]}
+    return {**mock_event_response, "aggregations": {"identifier": aggregation}}
+
+
+def mock_identifier_event_response(identifier, body):
+    """
+    Event count (and histogram) of a single identifier: all events are in January 2024.
+    """
+    buckets = mock_event_response["aggregations"]["identifier"]["buckets"]
+    count = next(
+        (bucket["doc_count"] for bucket in buckets if bucket["key"] == identifier), 0
+    )
+    response = {"hits": {"total": {"value": count, "relation": "eq"}, "hits": []}}
+    if "aggs" in body:
+        histogram = [{"key_as_string": "2024-01-01", "doc_count": count}]
+        response["aggregations"] = {"histogram": {"buckets": histogram}}
+    return response
+
+
 def mock_search_side_effect(*args, **kwargs):
     if kwargs["index"] == settings.OPENSEARCH_EVENT_INDEX:
-        return mock_event_response
+        body = kwargs["body"]
+        identifier_filters = [
+            clause["term"]["identifier"]
+            for clause in body["query"]["bool"]["must"]
+            if "identifier" in clause.get("term", {})
+        ]
+        if identifier_filters:
+            return mock_identifier_event_response(identifier_filters[0], body)
+        aggs = body["aggs"]["identifier"]
+        if "composite" in aggs:
+            return mock_composite_event_response(aggs)
+        return mock_terms_event_response(aggs)
     elif kwargs["index"] == settings.OPENSEARCH_WORK_INDEX:
         return mock_works_response
     else:
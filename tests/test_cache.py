@@ -0,0 +1,100 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+from lib import cache as cache_module
+from lib.cache import (
+    SharedCache,
+    cached_work_data,
+    decode_reservations,
+    encode_reservations,
+)
+from lib.models import Reservation
+
+
+class CacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = SharedCache(os.path.join(self.directory.name, "cache.sqlite"))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+
+class TestSharedCache(CacheTestCase):
+    def test_set_and_get(self):
+        self.cache.set("key", b"value", ttl=60)
+        assert self.cache.get("key") == b"value"
+        assert self.cache.get("missing") is None
+
+    def test_shared_between_instances(self):
+        """
+        Workers open the same file, so values written by one are seen by the others
+        """
+        self.cache.set("key", b"value", ttl=60)
+        other = SharedCache(self.cache.path)
+        assert other.get("key") == b"value"
+
+    def test_expired_values_are_not_returned(self):
+        self.cache.set("key", b"value", ttl=60)
+        with patch("lib.cache.time.time", return_value=10**11):
+            assert self.cache.get("key") is None
+
+    def test_disabled_cache(self):
+        disabled = SharedCache("")
+        disabled.set("key", b"value", ttl=60)
+        assert disabled.get("key") is None
+
+
+class TestEncoding(unittest.TestCase):
+    def test_reservations_round_trip(self):
+        reservations = [
+            Reservation(count=3, identifier="111", title="Kirja ä", author="Author"),
+            Reservation(count=1, identifier="222", title="", author=""),
+            Reservation(count=2, identifier="333"),
+        ]
+        decoded = decode_reservations(encode_reservations(reservations))
+
+        assert decoded == reservations
+        # Sparse rows stay sparse in responses
+        assert decoded[2].model_dump(exclude_unset=True) == {
+            "count": 2,
+            "identifier": "333",
+        }
+
+
+class TestCachedWorkData(CacheTestCase):
+    def test_only_missing_identifiers_are_fetched(self):
+        source = MagicMock(return_value={"111": {"title": "Book 1", "author": "A"}})
+
+        with patch.object(cache_module, "cache", self.cache):
+            first = cached_work_data(source, ["111", "222"])
+            second = cached_work_data(source, ["111", "222", "333"])
+
+        assert first == {"111": {"title": "Book 1", "author": "A"}}
+        assert second["111"] == {"title": "Book 1", "author": "A"}
+        assert source.call_args_list[1].args == (["333"],)
+
+
+class TestCachedEndpoints(CacheTestCase):
+    def test_token_and_response_are_served_from_cache(self):
+        import main
+        from tests import test_endpoints
+
+        headers = {"Token": "testtoken2"}
+        with patch.object(main, "cache", self.cache), patch.object(
+            cache_module, "cache", self.cache
+        ), patch.object(
+            main, "get_api_token", wraps=main.get_api_token
+        ) as get_api_token, patch.object(
+            main, "get_holds_with_edition_data", wraps=main.get_holds_with_edition_data
+        ) as get_holds:
+            first = test_endpoints.client.get("/active-reservations", headers=headers)
+            second = test_endpoints.client.get("/active-reservations", headers=headers)
+
+        assert first.status_code == second.status_code == 200
+        assert first.json() == second.json()
+        assert len(second.json()) == 2
+        assert get_api_token.call_count == 1
+        assert get_holds.call_count == 1
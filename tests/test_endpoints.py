@@ -1,14 +1,26 @@
 from fastapi.testclient import TestClient
+from fastapi import HTTPException
 import unittest
+from unittest.mock import patch
+
+from opensearchpy import ConnectionTimeout
 
 from main import app
 from lib.database import (
     get_db,
+    get_edition_data,
 )
+from config import settings
+from lib.models import Reservation
 from lib.opensearch import get_os_client
-from tests.database_testsetup import override_get_db
-from tests.opensearch_testsetup import override_get_os_client
-
+from tests.database_testsetup import override_get_db, test_db
+from tests.opensearch_testsetup import (
+    mock_os_client,
+    mock_paged_event_response,
+    mock_search_side_effect,
+    mock_works_response,
+    override_get_os_client,
+)
 
 # Patch the get_db and get_os_client functions with test versions
 app.dependency_overrides[get_db] = override_get_db
@@ -70,6 +82,77 @@ class TestActiveReservations(unittest.TestCase):
         output = response.json()
         assert len(output) == 0
 
+    def test_active_reservations_sorted_by_count_with_limit(self):
+        """
+        Collection 2 books tie on count, so they are ordered by identifier
+        """
+        headers = {"Token": "testtoken2"}
+        response = client.get(
+            "/active-reservations",
+            headers=headers,
+            params={"sort": "count_desc", "limit": 1},
+        )
+
+        assert response.status_code == 200
+
+        output = response.json()
+        assert len(output) == 1
+        assert output[0]["identifier"] == "test identifier B"
+
+    def test_active_reservations_min_count(self):
+        headers = {"Token": "testtoken1"}
+        response = client.get(
+            "/active-reservations", headers=headers, params={"min_count": 2}
+        )
+        assert response.status_code == 200
+        assert len(response.json()) == 1
+
+        headers = {"Token": "testtoken2"}
+        response = client.get(
+            "/active-reservations", headers=headers, params={"min_count": 2}
+        )
+        assert response.status_code == 200
+        assert len(response.json()) == 0
+
+    def test_active_reservations_identifier_prefix(self):
+        headers = {"Token": "testtoken2"}
+        response = client.get(
+            "/active-reservations",
+            headers=headers,
+            params={"identifier_prefix": "test identifier C"},
+        )
+
+        assert response.status_code == 200
+
+        output = response.json()
+        assert len(output) == 1
+        assert output[0]["identifier"] == "test identifier C"
+
+    def test_active_reservations_invalid_limit(self):
+        headers = {"Token": "testtoken1"}
+        response = client.get(
+            "/active-reservations", headers=headers, params={"limit": 0}
+        )
+        assert response.status_code == 422
+
+    def test_active_reservations_counts_only(self):
+        headers = {"Token": "testtoken1"}
+        response = client.get(
+            "/active-reservations",
+            headers=headers,
+            params={"fields": "identifier,count"},
+        )
+
+        assert response.status_code == 200
+        assert response.json() == [{"count": 2, "identifier": "test identifier A"}]
+
+    def test_active_reservations_invalid_field(self):
+        headers = {"Token": "testtoken1"}
+        response = client.get(
+            "/active-reservations", headers=headers, params={"fields": "count,isbn"}
+        )
+        assert response.status_code == 422
+
 
 class TestActiveReservationsForLicensePool(unittest.TestCase):
     def test_active_reservations_for_license_pool_unauthorized(self):
@@ -110,3 +193,372 @@ class TestReservationHistory(unittest.TestCase):
         assert first_book["author"] == "Author 1"
         assert second_book["title"] == "Book 2"
         assert second_book["author"] == "Author 2"
+
+    def test_reservation_history_query_is_pushed_to_aggregation(self):
+        headers = {"Token": "testtoken1"}
+        response = client.get(
+            "/reservation-history",
+            headers=headers,
+            params={
+                "sort": "count_desc",
+                "limit": 100,
+                "min_count": 2,
+                "identifier_prefix": "97895",
+            },
+        )
+
+        assert response.status_code == 200
+
+        event_query = next(
+            call.kwargs["body"]
+            for call in reversed(mock_os_client.search.call_args_list)
+            if call.kwargs["index"] == settings.OPENSEARCH_EVENT_INDEX
+        )
+        terms = event_query["aggs"]["identifier"]["terms"]
+        assert terms["size"] == 100
+        assert terms["min_doc_count"] == 2
+        assert terms["order"] == [{"_count": "desc"}, {"_key": "asc"}]
+        assert {"prefix": {"identifier": "97895"}} in event_query["query"]["bool"][
+            "must"
+        ]
+
+    def test_reservation_history_with_postgres_enrichment(self):
+        headers = {"Token": "testtoken1"}
+        mock_os_client.search.reset_mock()
+        with patch.object(settings, "ENRICHMENT_BACKEND", "postgres"):
+            response = client.get("/reservation-history", headers=headers)
+
+        assert response.status_code == 200
+        # Counts come from the events index but works index is never queried
+        assert len(response.json()) == 3
+        assert all(
+            call.kwargs["index"] != settings.OPENSEARCH_WORK_INDEX
+            for call in mock_os_client.search.call_args_list
+        )
+
+    def test_reservation_history_counts_only(self):
+        headers = {"Token": "testtoken1"}
+        mock_os_client.search.reset_mock()
+        response = client.get(
+            "/reservation-history",
+            headers=headers,
+            params={"fields": "identifier,count"},
+        )
+
+        assert response.status_code == 200
+        assert response.json()[0] == {"count": 3, "identifier": "111"}
+        # Only the event aggregation is queried
+        assert all(
+            call.kwargs["index"] == settings.OPENSEARCH_EVENT_INDEX
+            for call in mock_os_client.search.call_args_list
+        )
+
+    def test_reservation_history_title_only(self):
+        headers = {"Token": "testtoken1"}
+        response = client.get(
+            "/reservation-history", headers=headers, params={"fields": "title"}
+        )
+
+        assert response.status_code == 200
+        assert response.json()[0] == {
+            "count": 3,
+            "identifier": "111",
+            "title": "Book 1",
+        }
+
+    def test_reservation_history_partial_when_works_time_out(self):
+        def works_time_out(*args, **kwargs):
+            if kwargs["index"] == settings.OPENSEARCH_WORK_INDEX:
+                raise ConnectionTimeout("TIMEOUT", "Read timed out", None)
+            return mock_search_side_effect(*args, **kwargs)
+
+        headers = {"Token": "testtoken1"}
+        with patch.object(mock_os_client, "search", side_effect=works_time_out):
+            response = client.get("/reservation-history", headers=headers)
+
+        assert response.status_code == 200
+        assert response.headers["X-Partial-Response"] == "true"
+        output = response.json()
+        assert len(output) == 3
+        assert output[0] == {"count": 3, "identifier": "111", "title": "", "author": ""}
+
+    def test_reservation_history_complete_response_is_not_partial(self):
+        headers = {"Token": "testtoken1"}
+        response = client.get("/reservation-history", headers=headers)
+
+        assert response.status_code == 200
+        assert "X-Partial-Response" not in response.headers
+
+    def test_reservation_history_times_out_when_events_time_out(self):
+        def events_time_out(*args, **kwargs):
+            raise ConnectionTimeout("TIMEOUT", "Read timed out", None)
+
+        headers = {"Token": "testtoken1"}
+        with patch.object(mock_os_client, "search", side_effect=events_time_out):
+            response = client.get("/reservation-history", headers=headers)
+
+        assert response.status_code == 504
+
+    def test_reservation_history_is_streamed_in_chunks(self):
+        import main
+
+        headers = {"Token": "testtoken1"}
+        with patch.object(main, "STREAM_CHUNK_SIZE", 2):
+            chunks = list(
+                main.stream_json_array(
+                    iter(
+                        [
+                            Reservation(identifier="1", count=3),
+                            Reservation(identifier="2", count=2, title="B"),
+                            Reservation(identifier="3", count=1),
+                        ]
+                    )
+                )
+            )
+            response = client.get(
+                "/reservation-history", headers=headers, params={"fields": "count"}
+            )
+
+        assert chunks == [
+            "[",
+            '{"count":3,"identifier":"1"},{"count":2,"identifier":"2","title":"B"}',
+            ',{"count":1,"identifier":"3"}]',
+        ]
+        assert response.status_code == 200
+        assert response.json() == [
+            {"count": 3, "identifier": "111"},
+            {"count": 2, "identifier": "222"},
+            {"count": 1, "identifier": "333"},
+        ]
+
+    def test_reservation_history_partial_when_later_page_times_out(self):
+        work_searches = []
+
+        def second_page_times_out(*args, **kwargs):
+            if kwargs["index"] == settings.OPENSEARCH_WORK_INDEX:
+                work_searches.append(kwargs)
+                if len(work_searches) > 1:
+                    raise ConnectionTimeout("TIMEOUT", "Read timed out", None)
+                return mock_works_response
+            return mock_paged_event_response(kwargs["body"]["aggs"]["identifier"])
+
+        headers = {"Token": "testtoken1"}
+        with patch.object(mock_os_client, "search", side_effect=second_page_times_out):
+            response = client.get(
+                "/reservation-history",
+                headers=headers,
+                params={"sort": "identifier", "fields": "identifier,title"},
+            )
+
+        assert response.status_code == 200
+        assert response.headers["X-Partial-Response"] == "true"
+        assert response.json() == [
+            {"count": 3, "identifier": "111", "title": "Book 1"},
+            {"count": 2, "identifier": "222", "title": "Book 2"},
+            {"count": 1, "identifier": "333", "title": ""},
+        ]
+
+    def test_reservation_history_stream_aborts_when_later_page_times_out(self):
+        def second_page_times_out(*args, **kwargs):
+            aggs = kwargs["body"]["aggs"]["identifier"]
+            if "after" in aggs["composite"]:
+                raise ConnectionTimeout("TIMEOUT", "Read timed out", None)
+            return mock_paged_event_response(aggs)
+
+        headers = {"Token": "testtoken1"}
+        with patch.object(mock_os_client, "search", side_effect=second_page_times_out):
+            # The headers have been sent, so the transfer is cut off
+            with self.assertRaises(HTTPException):
+                client.get(
+                    "/reservation-history",
+                    headers=headers,
+                    params={"sort": "identifier", "fields": "count"},
+                )
+
+    def test_reservation_history_defaults_to_most_reserved(self):
+        headers = {"Token": "testtoken1"}
+        mock_os_client.search.reset_mock()
+        response = client.get(
+            "/reservation-history", headers=headers, params={"limit": 100}
+        )
+
+        assert response.status_code == 200
+        event_query = next(
+            call.kwargs["body"]
+            for call in mock_os_client.search.call_args_list
+            if call.kwargs["index"] == settings.OPENSEARCH_EVENT_INDEX
+        )
+        # The terms aggregation orders by count unless told otherwise
+        terms = event_query["aggs"]["identifier"]["terms"]
+        assert terms["size"] == 100
+        assert "order" not in terms
+
+    def test_reservation_history_pages_through_composite_aggregation(self):
+        headers = {"Token": "testtoken1"}
+        mock_os_client.search.reset_mock()
+        response = client.get(
+            "/reservation-history", headers=headers, params={"sort": "identifier"}
+        )
+
+        assert response.status_code == 200
+        assert [item["identifier"] for item in response.json()] == ["111", "222", "333"]
+
+        event_queries = [
+            call.kwargs["body"]
+            for call in mock_os_client.search.call_args_list
+            if call.kwargs["index"] == settings.OPENSEARCH_EVENT_INDEX
+        ]
+        # The second page continues after the last identifier of the first one
+        assert len(event_queries) == 2
+        assert event_queries[1]["aggs"]["identifier"]["composite"]["after"] == {
+            "identifier": "333"
+        }
+
+    def test_reservation_history_limit_stops_paging(self):
+        headers = {"Token": "testtoken1"}
+        mock_os_client.search.reset_mock()
+        response = client.get(
+            "/reservation-history",
+            headers=headers,
+            params={"sort": "identifier", "limit": 2},
+        )
+
+        assert response.status_code == 200
+        assert [item["identifier"] for item in response.json()] == ["111", "222"]
+        event_queries = [
+            call.kwargs["body"]
+            for call in mock_os_client.search.call_args_list
+            if call.kwargs["index"] == settings.OPENSEARCH_EVENT_INDEX
+        ]
+        assert len(event_queries) == 1
+        assert event_queries[0]["aggs"]["identifier"]["composite"]["size"] == 2
+
+
+class TestReservationHistoryWindows(unittest.TestCase):
+    def test_windows_unauthorized(self):
+        response = client.get(
+            "/reservation-history/windows", params={"window": "2024-01-01/"}
+        )
+        assert response.status_code == 403
+
+    def test_windows(self):
+        headers = {"Token": "testtoken1"}
+        mock_os_client.search.reset_mock()
+        response = client.get(
+            "/reservation-history/windows",
+            headers=headers,
+            params={"window": ["2024-01-01/2024-01-31", "2023-01-01/2023-01-31"]},
+        )
+
+        assert response.status_code == 200
+        output = response.json()
+        assert output[0] == {
+            "identifier": "111",
+            "title": "Book 1",
+            "author": "Author 1",
+            "counts": {"2024-01-01/2024-01-31": 3, "2023-01-01/2023-01-31": 2},
+        }
+        assert output[2]["counts"] == {
+            "2024-01-01/2024-01-31": 1,
+            "2023-01-01/2023-01-31": 0,
+        }
+
+        # All windows are counted in the same aggregation
+        event_query = mock_os_client.search.call_args_list[0].kwargs["body"]
+        window_filters = event_query["aggs"]["identifier"]["aggs"]["windows"][
+            "filters"
+        ]["filters"]
+        assert list(window_filters) == [
+            "2024-01-01/2024-01-31",
+            "2023-01-01/2023-01-31",
+        ]
+        # Works are looked up once for all windows
+        work_calls = [
+            call
+            for call in mock_os_client.search.call_args_list
+            if call.kwargs["index"] == settings.OPENSEARCH_WORK_INDEX
+        ]
+        assert len(work_calls) == 1
+
+    def test_invalid_window(self):
+        headers = {"Token": "testtoken1"}
+        for window in ("2024-01-01", "/", "2024-13-01/2024-12-31"):
+            response = client.get(
+                "/reservation-history/windows",
+                headers=headers,
+                params={"window": window},
+            )
+            assert response.status_code == 422
+
+    def test_window_ending_before_it_starts(self):
+        headers = {"Token": "testtoken1"}
+        response = client.get(
+            "/reservation-history/windows",
+            headers=headers,
+            params={"window": "2024-02-01/2024-01-01"},
+        )
+
+        assert response.status_code == 422
+        assert response.json() == {"detail": "Invalid window: 2024-02-01/2024-01-01"}
+
+
+class TestReservationHistoryForIdentifier(unittest.TestCase):
+    def test_reservation_history_for_identifier_unauthorized(self):
+        response = client.get("/reservation-history/111")
+        assert response.status_code == 403
+
+    def test_reservation_history_for_identifier(self):
+        headers = {"Token": "testtoken1"}
+        mock_os_client.search.reset_mock()
+        response = client.get("/reservation-history/222", headers=headers)
+
+        assert response.status_code == 200
+        assert response.json() == {
+            "count": 2,
+            "identifier": "222",
+            "title": "Book 2",
+            "author": "Author 2",
+        }
+
+        event_query = mock_os_client.search.call_args_list[0].kwargs["body"]
+        assert {"term": {"identifier": "222"}} in event_query["query"]["bool"]["must"]
+        assert "aggs" not in event_query
+
+    def test_reservation_history_for_identifier_histogram(self):
+        headers = {"Token": "testtoken1"}
+        mock_os_client.search.reset_mock()
+        response = client.get(
+            "/reservation-history/111", headers=headers, params={"interval": "month"}
+        )
+
+        assert response.status_code == 200
+        assert response.json()["histogram"] == [{"date": "2024-01-01", "count": 3}]
+        event_query = mock_os_client.search.call_args_list[0].kwargs["body"]
+        histogram = event_query["aggs"]["histogram"]["date_histogram"]
+        assert histogram["calendar_interval"] == "month"
+
+    def test_reservation_history_for_unknown_identifier(self):
+        headers = {"Token": "testtoken1"}
+        response = client.get("/reservation-history/999", headers=headers)
+        assert response.status_code == 404
+
+
+class TestEditionData(unittest.TestCase):
+    def test_get_edition_data(self):
+        """
+        Identifier A has two editions, the presentation edition is used
+        """
+        result = get_edition_data(
+            test_db, ["test identifier A", "test identifier C", "unknown"]
+        )
+
+        assert result == {
+            "test identifier A": {
+                "title": "Test book A Collection 1",
+                "author": "test author 1",
+            },
+            "test identifier C": {
+                "title": "Test book C Collection 2",
+                "author": "test author 2",
+            },
+        }
@@ -0,0 +1,124 @@
+import datetime
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from lib.holds_history import HoldsHistoryStore, record_holds_snapshot
+from tests.database_testsetup import test_db
+
+DAY_1 = datetime.date(2024, 5, 1)
+DAY_2 = datetime.date(2024, 5, 2)
+DAY_3 = datetime.date(2024, 5, 3)
+
+
+class HoldsHistoryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = HoldsHistoryStore(self.directory.name)
+        self.store.record(DAY_1, [(1, "A", 2), (2, "B", 1), (2, "C", 1)])
+        self.store.record(DAY_2, [(1, "A", 3), (2, "C", 4)])
+        self.store.record(DAY_3, [(1, "A", 1), (1, "D", 7)])
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+
+class TestHoldsHistoryStore(HoldsHistoryTestCase):
+    def test_read_collection(self):
+        result = self.store.read(2)
+
+        assert [(row.date, row.identifier, row.count) for row in result] == [
+            (DAY_1, "B", 1),
+            (DAY_1, "C", 1),
+            (DAY_2, "C", 4),
+        ]
+
+    def test_read_range(self):
+        result = self.store.read(1, from_date=DAY_2, to_date=DAY_3)
+
+        assert [(row.date, row.identifier, row.count) for row in result] == [
+            (DAY_2, "A", 3),
+            (DAY_3, "A", 1),
+            (DAY_3, "D", 7),
+        ]
+
+    def test_read_identifiers_includes_days_without_holds(self):
+        result = self.store.read(2, identifiers=["B"])
+
+        assert [(row.date, row.count) for row in result] == [
+            (DAY_1, 1),
+            (DAY_2, 0),
+            (DAY_3, 0),
+        ]
+
+    def test_recording_a_day_again_is_ignored(self):
+        self.store.record(DAY_3, [(1, "A", 100)])
+
+        result = self.store.read(1, from_date=DAY_3)
+        assert [row.count for row in result] == [1, 7]
+        assert self.store.snapshot_days() == [DAY_1, DAY_2, DAY_3]
+
+    def test_interrupted_append_is_discarded(self):
+        # Rows past the recorded row count are left over from a failed append
+        with open(f"{self.directory.name}/1/day", "ab") as column:
+            column.write(b"\x00\x01")
+
+        self.store.record(datetime.date(2024, 5, 4), [(1, "E", 5)])
+
+        result = self.store.read(1, from_date=datetime.date(2024, 5, 4))
+        assert [(row.identifier, row.count) for row in result] == [("E", 5)]
+
+
+class TestRecordHoldsSnapshot(unittest.TestCase):
+    def test_record_snapshot_from_database(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = HoldsHistoryStore(directory)
+
+            assert record_holds_snapshot(test_db, store, DAY_1)
+            assert not record_holds_snapshot(test_db, store, DAY_1)
+
+            result = store.read(2)
+            assert [(row.identifier, row.count) for row in result] == [
+                ("test identifier B", 1),
+                ("test identifier C", 1),
+            ]
+
+    def test_record_snapshot_from_queried_counts(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = HoldsHistoryStore(directory)
+            # Counts split by edition data are summed per identifier
+            hold_counts = [(1, "A", "Title", "", 2), (1, "A", "", "", 1)]
+
+            assert record_holds_snapshot(None, store, DAY_1, hold_counts)
+
+            result = store.read(1)
+            assert [(row.identifier, row.count) for row in result] == [("A", 3)]
+
+
+class TestActiveReservationsHistoryEndpoint(HoldsHistoryTestCase):
+    def test_history_not_enabled(self):
+        from tests.test_endpoints import client
+
+        response = client.get(
+            "/active-reservations/history", headers={"Token": "testtoken1"}
+        )
+        assert response.status_code == 404
+
+    def test_history(self):
+        import main
+        from tests.test_endpoints import client
+
+        with patch.object(main, "holds_history", self.store):
+            response = client.get(
+                "/active-reservations/history",
+                headers={"Token": "testtoken2"},
+                params={"from": "2024-05-02", "identifier": ["B", "C"]},
+            )
+
+        assert response.status_code == 200
+        assert response.json() == [
+            {"date": "2024-05-02", "identifier": "B", "count": 0},
+            {"date": "2024-05-02", "identifier": "C", "count": 4},
+            {"date": "2024-05-03", "identifier": "B", "count": 0},
+            {"date": "2024-05-03", "identifier": "C", "count": 0},
+        ]
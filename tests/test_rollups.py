@@ -0,0 +1,323 @@
+import datetime
+import tempfile
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+from config import settings
+from lib.database import get_hold_counts_by_collection
+from lib.holds_history import HoldsHistoryStore
+from lib.models import ReservationQuery, ReservationSort
+from lib.rollups import (
+    RollupStore,
+    read_reservation_events,
+    refresh_rollups,
+    refresh_scheduled_rollups,
+)
+from tests.database_testsetup import TestSessionLocal, test_db
+
+DAY_1 = datetime.date(2024, 5, 1)
+DAY_2 = datetime.date(2024, 5, 2)
+DAY_3 = datetime.date(2024, 5, 3)
+
+EVENT_COUNTS = [
+    ("Test Collection Name 2", DAY_1, "B", 1),
+    ("Test Collection Name 2", DAY_1, "C", 2),
+    ("Test Collection Name 2", DAY_2, "C", 3),
+    ("Test Collection Name 1", DAY_2, "A", 4),
+]
+
+
+def mock_rollup_client(event_counts, page_size=2):
+    """
+    OpenSearch client answering the earliest event and daily event count queries
+    from the given (collection_name, day, identifier, count) tuples.
+    """
+
+    def search(*args, **kwargs):
+        aggs = kwargs["body"]["aggs"]
+        if "earliest" in aggs:
+            days = [day for _, day, _, _ in event_counts]
+            if not days:
+                return {"aggregations": {"earliest": {"value": None}}}
+            return {
+                "aggregations": {
+                    "earliest": {
+                        "value": 0,
+                        "value_as_string": min(days).isoformat(),
+                    }
+                }
+            }
+
+        date_range = kwargs["body"]["query"]["bool"]["must"][1]["range"]["start"]
+        composite = aggs["rollup"]["composite"]
+        keys = sorted(
+            (collection, day.isoformat(), identifier, count)
+            for collection, day, identifier, count in event_counts
+            if date_range["gte"] <= day < date_range["lt"]
+        )
+        after = composite.get("after")
+        if after:
+            after_key = (after["collection"], after["day"], after["identifier"])
+            keys = [key for key in keys if key[:3] > after_key]
+        keys = keys[:page_size]
+        result = {
+            "buckets": [
+                {
+                    "key": {"collection": collection, "day": day, "identifier": key},
+                    "doc_count": count,
+                }
+                for collection, day, key, count in keys
+            ]
+        }
+        if keys:
+            collection, day, key, _ = keys[-1]
+            result["after_key"] = {
+                "collection": collection,
+                "day": day,
+                "identifier": key,
+            }
+        return {"aggregations": {"rollup": result}}
+
+    client = MagicMock()
+    client.search.side_effect = search
+    return client
+
+
+class RollupsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = RollupStore(f"{self.directory.name}/rollups.sqlite")
+        refresh_rollups(
+            test_db, mock_rollup_client(EVENT_COUNTS), self.store, today=DAY_3
+        )
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+
+class TestRefreshRollups(RollupsTestCase):
+    def test_event_coverage(self):
+        meta = self.store.meta()
+
+        assert meta["events_first_day"] == DAY_1.toordinal()
+        assert meta["events_last_day"] == DAY_2.toordinal()
+
+    def test_refresh_recounts_last_day(self):
+        late_events = [*EVENT_COUNTS, ("Test Collection Name 2", DAY_2, "B", 5)]
+        client = mock_rollup_client(late_events)
+
+        refresh_rollups(test_db, client, self.store, today=DAY_3)
+
+        # Only the last rolled up day is queried again
+        for call in client.search.call_args_list:
+            date_range = call.kwargs["body"]["query"]["bool"]["must"][1]["range"]
+            assert date_range["start"]["gte"] == DAY_2
+        result = self.store.read_event_counts(
+            "Test Collection Name 2", DAY_1, DAY_2, ReservationQuery()
+        )
+        assert result == [("B", 6), ("C", 5)]
+
+    def test_scheduled_refresh_records_holds_snapshot(self):
+        def get_os_client():
+            yield mock_rollup_client(EVENT_COUNTS)
+
+        with tempfile.TemporaryDirectory() as directory, patch(
+            "lib.rollups.SessionLocal", TestSessionLocal
+        ), patch("lib.rollups.get_os_client", get_os_client), patch(
+            "lib.rollups.get_hold_counts_by_collection",
+            wraps=get_hold_counts_by_collection,
+        ) as hold_query:
+            store = RollupStore(f"{directory}/rollups.sqlite")
+            snapshots = HoldsHistoryStore(f"{directory}/holds")
+
+            assert refresh_scheduled_rollups(store, 3600, snapshots=snapshots)
+
+            # The rollup and the snapshot share one hold count query
+            assert hold_query.call_count == 1
+            assert snapshots.snapshot_days() == [datetime.date.today()]
+            result = snapshots.read(2)
+            assert [(row.identifier, row.count) for row in result] == [
+                ("test identifier B", 1),
+                ("test identifier C", 1),
+            ]
+
+    def test_refresh_without_events(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = RollupStore(f"{directory}/rollups.sqlite")
+
+            refresh_rollups(test_db, mock_rollup_client([]), store, today=DAY_3)
+
+            # Days without events are covered, with no counts
+            assert store.meta()["events_last_day"] == DAY_2.toordinal()
+            assert (
+                store.read_event_counts(
+                    "Test Collection Name 2", None, DAY_2, ReservationQuery()
+                )
+                == []
+            )
+            result, _ = store.read_hold_counts(2, ReservationQuery(), max_age=60)
+            assert [(row.identifier, row.count) for row in result] == [
+                ("test identifier B", 1),
+                ("test identifier C", 1),
+            ]
+
+
+class TestRollupStore(RollupsTestCase):
+    def test_read_event_counts_includes_to_date(self):
+        result = self.store.read_event_counts(
+            "Test Collection Name 2", DAY_2, DAY_2, ReservationQuery()
+        )
+
+        assert result == [("C", 3)]
+
+    def test_read_event_counts_defaults_to_count_order(self):
+        result = self.store.read_event_counts(
+            "Test Collection Name 2", DAY_1, DAY_2, ReservationQuery()
+        )
+
+        assert result == [("C", 5), ("B", 1)]
+
+    def test_read_event_counts_with_params(self):
+        params = ReservationQuery(sort=ReservationSort.count_desc, min_count=2, limit=1)
+
+        result = self.store.read_event_counts(
+            "Test Collection Name 2", None, DAY_2, params
+        )
+
+        assert result == [("C", 5)]
+
+    def test_uncovered_date_frames_are_not_served(self):
+        params = ReservationQuery()
+
+        assert (
+            self.store.read_event_counts("Test Collection Name 2", DAY_1, None, params)
+            is None
+        )
+        # Today (DAY_3) hasn't been rolled up yet
+        assert (
+            self.store.read_event_counts("Test Collection Name 2", DAY_1, DAY_3, params)
+            is None
+        )
+
+    def test_stale_hold_counts_are_not_served(self):
+        self.store.replace_hold_counts([(1, "A", "", "", 1)], time.time() - 120)
+
+        assert self.store.read_hold_counts(1, ReservationQuery(), max_age=60) is None
+
+    def test_hold_counts_are_not_served_without_max_age(self):
+        assert self.store.read_hold_counts(1, ReservationQuery(), max_age=0) is None
+
+    def test_missing_and_empty_titles_are_summed(self):
+        self.store.replace_hold_counts(
+            [(1, "A", None, "author", 1), (1, "A", "", "author", 2)], time.time()
+        )
+
+        result, _ = self.store.read_hold_counts(1, ReservationQuery(), max_age=60)
+
+        assert [row.model_dump() for row in result] == [
+            {"count": 3, "identifier": "A", "title": "", "author": "author"}
+        ]
+
+    def test_read_hold_counts_with_prefix(self):
+        params = ReservationQuery(identifier_prefix="test identifier C")
+
+        result, _ = self.store.read_hold_counts(2, params, max_age=60)
+
+        assert [row.model_dump() for row in result] == [
+            {
+                "count": 1,
+                "identifier": "test identifier C",
+                "title": "Test book C Collection 2",
+                "author": "test author 2",
+            }
+        ]
+
+    def test_read_reservation_events_enriches_rows(self):
+        def work_data_source(identifiers):
+            return {"C": {"title": "Title C", "author": "Author C"}}
+
+        result = read_reservation_events(
+            self.store,
+            collection_name="Test Collection Name 2",
+            from_date=DAY_1,
+            to_date=DAY_2,
+            params=ReservationQuery(),
+            work_data_source=work_data_source,
+        )
+
+        assert [row.model_dump() for row in result] == [
+            {"count": 5, "identifier": "C", "title": "Title C", "author": "Author C"},
+            {"count": 1, "identifier": "B", "title": "", "author": ""},
+        ]
+
+
+class TestRollupEndpoints(RollupsTestCase):
+    def test_active_reservations_from_rollup(self):
+        import main
+        from tests.test_endpoints import client
+
+        computed_at = datetime.datetime(2024, 5, 3, 12, tzinfo=datetime.timezone.utc)
+        self.store.replace_hold_counts(
+            [(1, "rolled up", "", "", 9)], computed_at.timestamp()
+        )
+        with patch.object(main, "rollups", self.store), patch.object(
+            settings, "ROLLUP_HOLDS_MAX_AGE", 10**10
+        ):
+            response = client.get(
+                "/active-reservations",
+                headers={"Token": "testtoken1"},
+                params={"fields": "identifier,count"},
+            )
+
+        assert response.status_code == 200
+        assert response.headers["X-Data-As-Of"] == "2024-05-03T12:00:00+00:00"
+        assert response.json() == [{"count": 9, "identifier": "rolled up"}]
+
+    def test_active_reservations_are_live_by_default(self):
+        import main
+        from tests.test_endpoints import client
+
+        self.store.replace_hold_counts([(1, "rolled up", "", "", 9)], time.time())
+        with patch.object(main, "rollups", self.store):
+            response = client.get(
+                "/active-reservations",
+                headers={"Token": "testtoken1"},
+                params={"fields": "identifier,count"},
+            )
+
+        assert response.status_code == 200
+        assert "X-Data-As-Of" not in response.headers
+        assert "rolled up" not in [item["identifier"] for item in response.json()]
+
+    def test_reservation_history_from_rollup(self):
+        import main
+        from tests.test_endpoints import client
+
+        with patch.object(main, "rollups", self.store):
+            response = client.get(
+                "/reservation-history",
+                headers={"Token": "testtoken2"},
+                params={"to": "2024-05-02", "fields": "identifier,count"},
+            )
+
+        assert response.status_code == 200
+        assert response.json() == [
+            {"count": 5, "identifier": "C"},
+            {"count": 1, "identifier": "B"},
+        ]
+
+    def test_reservation_history_not_rolled_up_is_live(self):
+        import main
+        from tests.test_endpoints import client
+
+        with patch.object(main, "rollups", self.store):
+            response = client.get(
+                "/reservation-history",
+                headers={"Token": "testtoken2"},
+                params={"to": "2024-05-03", "fields": "identifier,count"},
+            )
+
+        assert response.status_code == 200
+        # Counted from the (mock) event index
+        assert [item["identifier"] for item in response.json()] == ["111", "222", "333"]
@@ -0,0 +1,72 @@
+import time
+import unittest
+from unittest.mock import patch
+
+import main
+from config import settings
+from lib.slow_requests import slow_requests
+from tests.opensearch_testsetup import override_get_os_client
+from tests.test_endpoints import client
+
+
+class TestSlowRequests(unittest.TestCase):
+    def setUp(self):
+        slow_requests.samples.clear()
+
+    def test_admin_endpoint_not_enabled(self):
+        response = client.get("/admin/slow-requests")
+        assert response.status_code == 404
+
+    def test_admin_endpoint_requires_token(self):
+        with patch.object(settings, "ADMIN_TOKEN", "admin"):
+            response = client.get(
+                "/admin/slow-requests", headers={"Admin-Token": "wrong"}
+            )
+        assert response.status_code == 403
+
+    def test_slow_request_is_captured(self):
+        with patch.object(slow_requests, "threshold", 1e-9), patch.object(
+            settings, "SLOW_REQUEST_PROFILE", True
+        ), patch.object(settings, "ADMIN_TOKEN", "admin"), patch.object(
+            main, "get_os_client", override_get_os_client
+        ):
+            client.get("/reservation-history", headers={"Token": "testtoken1"})
+            response = client.get(
+                "/admin/slow-requests", headers={"Admin-Token": "admin"}
+            )
+
+        assert response.status_code == 200
+        samples = response.json()
+        assert len(samples) == 1
+        sample = samples[0]
+        assert sample["path"] == "/reservation-history"
+        assert sample["status_code"] == 200
+
+        sql = [query for query in sample["queries"] if query["type"] == "sql"]
+        searches = [
+            query for query in sample["queries"] if query["type"] == "opensearch"
+        ]
+        # The API token lookup is captured without its parameters
+        assert "apitokens" in sql[0]["statement"]
+        assert sql[0]["parameters"] is None
+        assert searches[0]["index"] == settings.OPENSEARCH_EVENT_INDEX
+        assert "aggs" in searches[0]["body"]
+        assert "profile" in searches[0]
+
+    def test_streamed_body_is_timed(self):
+        def slow_stream(rows):
+            time.sleep(0.2)
+            yield "[]"
+
+        with patch.object(slow_requests, "threshold", 0.1), patch.object(
+            main, "stream_json_array", slow_stream
+        ), patch.object(main, "get_os_client", override_get_os_client):
+            response = client.get(
+                "/reservation-history",
+                headers={"Token": "testtoken1"},
+                params={"fields": "count"},
+            )
+
+        assert response.json() == []
+        assert len(slow_requests.samples) == 1
+        assert slow_requests.samples[0]["duration"] >= 0.2